@@ -14,4 +14,8 @@ setup(
     author="Henry Landis",
     author_email="hnl2109@columbia.edu",
     description="A package to calculate species range overlap from occurrence data.",
+    packages=["sproc"],
+    entry_points={
+        "console_scripts": ["sproc = sproc.cli:main"],
+    },
 )
\ No newline at end of file
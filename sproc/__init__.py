@@ -10,6 +10,7 @@ import sproc.fetch
 import sproc.jsonify
 import sproc.imap
 import sproc.smap
+import sproc.overlap
 from sproc.newsproc import Sproc
 from sproc.helpers import set_loglevel
 
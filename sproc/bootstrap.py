@@ -0,0 +1,213 @@
+#!/usr/env/bin python
+
+"""
+Resampling confidence intervals for range area and overlap.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from scipy import stats
+from loguru import logger
+from sproc.globals import LAND
+from sproc.neighbors import load_points
+
+
+def _hulls(coords, indices, land):
+    """
+    Worker function returning the land-clipped convex hulls of the
+    points at each row of indices, as WKB.  Repeated draws of a point
+    don't change a hull, so each point is used once per replicate.
+    """
+    drawn = np.zeros((len(indices), len(coords)), dtype = bool)
+    drawn[np.arange(len(indices))[:, None], indices] = True
+    rows, cols = np.nonzero(drawn)
+    points = shapely.multipoints(coords[cols], indices = rows)
+    hulls = shapely.convex_hull(points)
+    return shapely.to_wkb(shapely.intersection(hulls, land)), shapely.area(hulls)
+
+
+class RangeBootstrap:
+    """
+    Builds replicate ranges from resampled non-outlier occurrences of
+    one species and stores the hull area and land-clipped area of each.
+
+    Every replicate hull lies inside the hull of all points, so LAND is
+    clipped to that hull once and shared by all replicates.  Hulls are
+    built in vectorized batches, optionally across worker processes.
+
+    Parameters
+    ----------
+    source: str or Sproc
+        A sproc GeoJSON file or Sproc object.
+    replicates: int
+        Number of bootstrap replicates.  Ignored for the jackknife,
+        which has one replicate per point.
+    method: str
+        'bootstrap' (resample with replacement) or 'jackknife' (leave
+        one point out).
+    jobs: int
+        Number of worker processes.
+    batch: int
+        Replicates per vectorized batch.
+    """
+    def __init__(
+        self,
+        source,
+        replicates = 1000,
+        method = "bootstrap",
+        seed = None,
+        jobs = 1,
+        batch = 50,
+        land = LAND,
+        ):
+        self.name, lons, lats = load_points(source)
+        self.coords = np.column_stack([lons, lats]).astype(float)
+        self.method = method
+
+        # Full-sample range, and the land inside it shared by replicates.
+        full = shapely.multipoints(self.coords).convex_hull
+        self.land = full.intersection(land)
+        self.estimate = {"hull_area": full.area, "land_area": self.land.area}
+
+        # Get replicate index arrays.
+        if method == "bootstrap":
+            rng = np.random.default_rng(seed)
+            indices = rng.integers(0, len(self.coords), (replicates, len(self.coords)))
+        elif method == "jackknife":
+            indices = self._jackknife_indices()
+        else:
+            raise ValueError(f"unknown resampling method: {method}")
+
+        # Placeholders for replicate ranges and their areas.
+        self.ranges = None
+        self.results = None
+
+        # Run internal functions.
+        self._run(indices, jobs, batch)
+        logger.info(f"built {len(self.results)} {method} replicates for {self.name}")
+
+
+    def _jackknife_indices(self):
+        """
+        Leaving out a point that is not a hull vertex gives the full
+        hull, so only leave-one-out sets for the hull vertices are
+        built.  The other replicates are filled in by _run.
+        """
+        hull = shapely.multipoints(self.coords).convex_hull
+        vertices = shapely.get_coordinates(hull)
+        self._vertex = np.zeros(len(self.coords), dtype = bool)
+        for vertex in np.unique(vertices, axis = 0):
+            self._vertex |= (self.coords == vertex).all(axis = 1)
+        everyone = np.arange(len(self.coords))
+        return np.array([everyone[everyone != i] for i in np.flatnonzero(self._vertex)])
+
+
+    def _run(self, indices, jobs, batch):
+        """
+        Build hulls for batches of replicates, across processes if
+        jobs > 1.
+        """
+        batches = [indices[i:i + batch] for i in range(0, len(indices), batch)]
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers = jobs) as pool:
+                futures = [pool.submit(_hulls, self.coords, i, self.land) for i in batches]
+                parts = [i.result() for i in futures]
+        else:
+            parts = [_hulls(self.coords, i, self.land) for i in batches]
+        ranges = shapely.from_wkb(np.concatenate([i[0] for i in parts])) if parts else np.array([])
+        hull_area = np.concatenate([i[1] for i in parts]) if parts else np.array([])
+
+        # For the jackknife, replicates without a hull vertex match the full range.
+        if self.method == "jackknife":
+            full_ranges = np.full(len(self.coords), self.land, dtype = object)
+            full_areas = np.full(len(self.coords), self.estimate["hull_area"])
+            full_ranges[self._vertex] = ranges
+            full_areas[self._vertex] = hull_area
+            ranges, hull_area = full_ranges, full_areas
+
+        self.ranges = ranges
+        self.results = pd.DataFrame({
+            "hull_area": hull_area,
+            "land_area": shapely.area(ranges),
+        })
+
+
+    def interval(self, level = 0.95, kind = "percentile"):
+        """
+        Returns a dataframe with the full-sample estimate and confidence
+        interval of each statistic.
+
+        Every replicate hull lies inside the full-sample hull, so
+        replicate areas are biased low: the default 'percentile'
+        interval describes the variability of the areas but is shifted
+        downward, and its upper bound can fall below the estimate.
+        'basic' (reverse percentile) reflects the replicates about the
+        estimate instead, which can exclude the estimate from the
+        other side, so it is not the default.  Jackknife intervals are
+        normal intervals from its standard error.  Lower bounds are
+        clamped at 0.
+        """
+        return confidence_interval(self.results, self.estimate, self.method, level, kind)
+
+
+def confidence_interval(results, estimate, method = "bootstrap", level = 0.95, kind = "percentile"):
+    """
+    Percentile or basic (reverse percentile) intervals for bootstrap
+    replicates, or normal intervals from the jackknife standard error.
+    Percentile intervals of hull areas are biased low, see
+    RangeBootstrap.interval.  All statistics are areas or fractions,
+    so bounds are clamped at 0.
+    """
+    if kind not in ("basic", "percentile"):
+        raise ValueError(f"unknown interval kind: {kind}")
+    rows = {}
+    alpha = (1. - level) / 2.
+    for column in results.columns:
+        values = results[column].to_numpy()
+        if method == "jackknife":
+            n = len(values)
+            se = np.sqrt((n - 1) / n * ((values - values.mean()) ** 2).sum())
+            z = stats.norm.ppf(1. - alpha)
+            lower, upper = estimate[column] - z * se, estimate[column] + z * se
+        else:
+            low, high = np.quantile(values, [alpha, 1. - alpha])
+            if kind == "basic":
+                lower, upper = 2. * estimate[column] - high, 2. * estimate[column] - low
+            else:
+                lower, upper = low, high
+        rows[column] = {"estimate": estimate[column], "lower": max(lower, 0.), "upper": max(upper, 0.)}
+    return pd.DataFrame(rows).T
+
+
+def overlap_bootstrap(boot_a, boot_b, level = 0.95):
+    """
+    Pairwise overlap of two species' bootstrap replicates, paired by
+    replicate number.  Returns (replicate results, interval table) for
+    the shared land-clipped area and the fraction of each species'
+    range that it covers.
+    """
+    if boot_a.method != "bootstrap" or boot_b.method != "bootstrap":
+        raise ValueError("overlap intervals need bootstrap replicates")
+    count = min(len(boot_a.ranges), len(boot_b.ranges))
+    a, b = boot_a.ranges[:count], boot_b.ranges[:count]
+    shared = shapely.area(shapely.intersection(a, b))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        results = pd.DataFrame({
+            "overlap_area": shared,
+            "fraction_a": shared / shapely.area(a),
+            "fraction_b": shared / shapely.area(b),
+        })
+    full = boot_a.land.intersection(boot_b.land).area
+    estimate = {
+        "overlap_area": full,
+        "fraction_a": full / boot_a.land.area if boot_a.land.area else 0.,
+        "fraction_b": full / boot_b.land.area if boot_b.land.area else 0.,
+    }
+    table = confidence_interval(results.fillna(0.), estimate, level = level)
+
+    # Fractions can't exceed 1.
+    fractions = ["fraction_a", "fraction_b"]
+    table.loc[fractions, ["lower", "upper"]] = table.loc[fractions, ["lower", "upper"]].clip(upper = 1.)
+    return results, table
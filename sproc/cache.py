@@ -0,0 +1,187 @@
+#!/usr/env/bin python
+
+"""
+A content-addressed on-disk cache of built geographic ranges.
+"""
+
+import os
+import io
+import json
+import glob
+import hashlib
+import zipfile
+import numpy as np
+import shapely
+from loguru import logger
+from sproc.globals import LAND, LANDCOVER_FILE
+
+
+# Default location of the range cache shared by all runs.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sproc", "ranges")
+
+# Modules whose code determines a build: outlier rules, hull, land
+# clip and simplified copies, and coordinate precision.
+BUILD_MODULES = ("sproc.jsonify", "sproc.outliers", "sproc.quantize")
+
+# Hash of the land cover file, computed on first use.
+_LAND_VERSION = {}
+
+# Hash of the build code, computed on first use.
+_BUILD_VERSION = {}
+
+
+def land_version(land = None):
+    """
+    Returns a hash identifying a land geometry: the hash of the land
+    cover file for the global LAND, or of the WKB for any other land.
+    """
+    if land is None or land is LAND:
+        if "file" not in _LAND_VERSION:
+            with open(LANDCOVER_FILE, 'rb') as inf:
+                _LAND_VERSION["file"] = hashlib.sha256(inf.read()).hexdigest()
+        return _LAND_VERSION["file"]
+    return hashlib.sha256(shapely.to_wkb(land)).hexdigest()
+
+
+def build_version(modules = BUILD_MODULES):
+    """
+    Returns a hash of the source of the modules that build ranges and
+    the GEOS version, so cached builds are not reused after the
+    outlier, hull or clipping code changes.
+    """
+    if modules not in _BUILD_VERSION:
+        import importlib
+        digest = hashlib.sha256(shapely.geos_version_string.encode())
+        for name in modules:
+            with open(importlib.import_module(name).__file__, 'rb') as inf:
+                digest.update(inf.read())
+        _BUILD_VERSION[modules] = digest.hexdigest()
+    return _BUILD_VERSION[modules]
+
+
+def content_key(arrays, params):
+    """
+    Returns a sha256 hex key for a list of arrays, a dict of
+    parameters and the sproc version.
+    """
+    from sproc import __version__
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode())
+        digest.update(array.tobytes())
+    digest.update(json.dumps(params, sort_keys = True, default = str).encode())
+    digest.update(__version__.encode())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """
+    Stores finished range builds (outlier scores and mask, the range
+    geometry and its simplified copies) under a hash of everything that
+    determines them.  Least recently used entries are removed once the
+    cache grows past max_bytes.
+
+    Parameters
+    ----------
+    path: str
+        Directory holding one .npz file per entry.
+    max_bytes: int
+        Size limit of the cache directory.
+    """
+    def __init__(self, path = CACHE_DIR, max_bytes = 2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok = True)
+
+
+    def key(self, arrays, params, land = None):
+        """
+        Returns a sha256 hex key for input arrays, a dict of parameters,
+        the land geometry, the build code and the sproc version.
+        """
+        return content_key(arrays, {**params, "land": land_version(land), "code": build_version()})
+
+
+    def get(self, key):
+        """
+        Returns the cached build for key as a dict, or None.  A hit
+        marks the entry as recently used.  An entry evicted or left
+        unreadable by another process is a miss.
+        """
+        entry = os.path.join(self.path, key + ".npz")
+        try:
+            with np.load(entry, allow_pickle = False) as arrs:
+                build = {
+                    "distance": arrs["distance"],
+                    "mask": arrs["mask"],
+                    "georange": shapely.from_wkb(arrs["georange"].tobytes()),
+                    "simplified": {},
+                }
+
+                # Simplified copies are stored as one buffer of WKB.
+                wkb = arrs["simplified"].tobytes()
+                offsets = arrs["offsets"]
+                for idx, tolerance in enumerate(arrs["tolerances"].tolist()):
+                    part = wkb[offsets[idx]:offsets[idx + 1]]
+                    build["simplified"][tolerance] = shapely.from_wkb(part)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile, shapely.errors.GEOSException) as err:
+            logger.warning(f"unreadable cache entry {key[:12]}: {err!r}")
+            return None
+
+        # Mark as recently used, unless it was evicted meanwhile.
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            pass
+        logger.debug(f"cache hit {key[:12]}")
+        return build
+
+
+    def put(self, key, distance, mask, georange, simplified):
+        """
+        Store a build and evict old entries if over the size limit.
+        """
+        wkbs = [shapely.to_wkb(i) for i in simplified.values()]
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            distance = np.asarray(distance, dtype = float),
+            mask = np.asarray(mask, dtype = bool),
+            georange = np.frombuffer(shapely.to_wkb(georange), dtype = np.uint8),
+            tolerances = np.array(list(simplified), dtype = float),
+            simplified = np.frombuffer(b"".join(wkbs), dtype = np.uint8),
+            offsets = np.cumsum([0] + [len(i) for i in wkbs]),
+        )
+
+        # Write to a temporary file and move it into place.
+        entry = os.path.join(self.path, key + ".npz")
+        tmpfile = f"{entry}.{os.getpid()}.tmp"
+        with open(tmpfile, 'wb') as outf:
+            outf.write(buffer.getvalue())
+        os.replace(tmpfile, entry)
+        self.evict()
+
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits.
+        """
+        entries = []
+        for entry in glob.glob(os.path.join(self.path, "*.npz")):
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(i[1] for i in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            total -= size
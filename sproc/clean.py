@@ -0,0 +1,215 @@
+#!/usr/env/bin python
+
+"""
+Flag occurrence records with suspect coordinates.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+from loguru import logger
+from sproc.globals import COUNTRIES_FILE, REFERENCE_FILE
+from sproc.neighbors import unit_vectors, km_to_chord
+
+
+# GBIF interpretation issues that make coordinates unreliable.
+BAD_ISSUES = (
+    "ZERO_COORDINATE",
+    "COORDINATE_INVALID",
+    "COORDINATE_OUT_OF_RANGE",
+    "COUNTRY_COORDINATE_MISMATCH",
+    "PRESUMED_SWAPPED_COORDINATE",
+    "PRESUMED_NEGATED_LATITUDE",
+    "PRESUMED_NEGATED_LONGITUDE",
+)
+
+
+def zero_coordinates(data, **kwargs):
+    """
+    Records at 0/0, a common placeholder.
+    """
+    return (data.decimalLatitude == 0) & (data.decimalLongitude == 0)
+
+
+def invalid_coordinates(data, **kwargs):
+    """
+    Records outside the valid lat/long range.
+    """
+    return (data.decimalLatitude.abs() > 90) | (data.decimalLongitude.abs() > 180)
+
+
+def equal_coordinates(data, **kwargs):
+    """
+    Records with latitude equal to longitude, usually a copy error.
+    """
+    return data.decimalLatitude == data.decimalLongitude
+
+
+def rounded_coordinates(data, **kwargs):
+    """
+    Records on whole degrees of both latitude and longitude, which are
+    often a country or grid centroid rather than a locality.
+    """
+    return (data.decimalLatitude % 1 == 0) & (data.decimalLongitude % 1 == 0)
+
+
+def uncertain_coordinates(data, max_uncertainty = 100000., **kwargs):
+    """
+    Records with a coordinate uncertainty (m) above max_uncertainty.
+    """
+    if "coordinateUncertaintyInMeters" not in data.columns:
+        return pd.Series(False, index = data.index)
+    return pd.to_numeric(data.coordinateUncertaintyInMeters, errors = "coerce") > max_uncertainty
+
+
+def issue_coordinates(data, issues = BAD_ISSUES, **kwargs):
+    """
+    Records with any of the GBIF issues flags in `issues`.
+    """
+    if "issues" not in data.columns:
+        return pd.Series(False, index = data.index)
+    pattern = "|".join(issues)
+    return data.issues.astype("string").str.contains(pattern, regex = True).fillna(False).astype(bool)
+
+
+def read_reference(paths = (), default = True):
+    """
+    Returns a dataframe of reference points from CSV files with
+    decimalLongitude and decimalLatitude columns, starting with the
+    country centroids in REFERENCE_FILE if default.  Extra files can
+    add e.g. capitals, or herbaria and other institutions.
+    """
+    paths = ([REFERENCE_FILE] if default else []) + list(paths or [])
+    if not paths:
+        return pd.DataFrame([], columns = ["decimalLongitude", "decimalLatitude"])
+    return pd.concat([pd.read_csv(i) for i in paths], ignore_index = True)
+
+
+def read_countries(path = COUNTRIES_FILE):
+    """
+    Returns a Series of country polygons indexed by countryCode.
+    """
+    import geopandas
+    countries = geopandas.read_file(path)
+    return pd.Series(countries.geometry.to_numpy(), index = countries.countryCode.to_numpy())
+
+
+def reference_coordinates(data, reference = None, radius = 2., **kwargs):
+    """
+    Records within radius km of a reference point, e.g. country or
+    province centroids, capitals, or herbaria and other institutions.
+    `reference` is an (n, 2) array of lon/lat, or a dataframe as
+    returned by read_reference.
+    """
+    if reference is None or not len(reference):
+        return pd.Series(False, index = data.index)
+    if isinstance(reference, pd.DataFrame):
+        reference = reference[["decimalLongitude", "decimalLatitude"]]
+    reference = np.asarray(reference, dtype = float)
+    tree = cKDTree(unit_vectors(reference[:, 0], reference[:, 1]))
+    dist, _ = tree.query(
+        unit_vectors(data.decimalLongitude, data.decimalLatitude),
+        k = 1,
+        distance_upper_bound = km_to_chord(radius),
+        workers = -1,
+    )
+    return pd.Series(np.isfinite(dist), index = data.index)
+
+
+def swapped_coordinates(data, countries = None, **kwargs):
+    """
+    Records outside the country named by their countryCode that fall
+    inside it once latitude and longitude are swapped.  `countries` is
+    a Series of polygons by countryCode, as returned by read_countries.
+    """
+    if countries is None or "countryCode" not in data.columns:
+        return pd.Series(False, index = data.index)
+
+    # Test each record against its own country only.
+    codes = data.countryCode.to_numpy(dtype = object)
+    known = pd.Index(countries.index).get_indexer(codes) >= 0
+    geoms = countries.loc[codes[known]].to_numpy()
+    shapely.prepare(geoms)
+    lons = data.decimalLongitude.to_numpy(dtype = float)[known]
+    lats = data.decimalLatitude.to_numpy(dtype = float)[known]
+    mask = np.zeros(len(data), dtype = bool)
+    mask[known] = ~shapely.contains_xy(geoms, lons, lats) & shapely.contains_xy(geoms, lats, lons)
+    return pd.Series(mask, index = data.index)
+
+
+# Cleaning rules selectable by name.
+RULES = {
+    "zero": zero_coordinates,
+    "invalid": invalid_coordinates,
+    "equal": equal_coordinates,
+    "rounded": rounded_coordinates,
+    "uncertainty": uncertain_coordinates,
+    "issues": issue_coordinates,
+    "reference": reference_coordinates,
+    "swapped": swapped_coordinates,
+}
+
+# Rules applied by default.  Whole-degree records are common in old
+# herbarium data.
+DEFAULT_RULES = ("zero", "invalid", "equal", "uncertainty", "issues", "reference", "swapped")
+
+
+class CoordinateCleaner:
+    """
+    Applies a set of coordinate tests to all records at once.  Each
+    rule is a column-wise test over the dataframe; a record is flagged
+    if any rule flags it.  Flagged records are left out of the outlier
+    rule and the range, and written as outliers, by GeographicRange.
+
+    Parameters
+    ----------
+    rules: list
+        Names of rules in RULES.  Defaults to DEFAULT_RULES.
+    **kwargs:
+        Rule parameters: max_uncertainty (m), issues (GBIF issue
+        names), reference (lon/lat array or dataframe; defaults to the
+        shipped country centroids), radius (km) and countries
+        (polygons by countryCode; defaults to the shipped countries).
+    """
+    def __init__(self, rules = None, **kwargs):
+        self.rules = list(DEFAULT_RULES) if rules is None else list(rules)
+        for rule in self.rules:
+            if rule not in RULES:
+                raise ValueError(f"unknown cleaning rule: {rule}")
+
+        # Read the shipped tables once, for rules that need them.
+        if "reference" in self.rules and kwargs.get("reference") is None:
+            kwargs["reference"] = read_reference()
+        if "swapped" in self.rules and kwargs.get("countries") is None:
+            kwargs["countries"] = read_countries()
+        self.kwargs = kwargs
+        self.counts = {}
+
+
+    def flags(self, data):
+        """
+        Returns a boolean dataframe with a column per rule.
+        """
+        return pd.DataFrame({
+            rule: np.asarray(RULES[rule](data, **self.kwargs), dtype = bool)
+            for rule in self.rules
+        }, index = data.index)
+
+
+    def apply(self, data, drop = False):
+        """
+        Adds a 'flagged' column to a dataframe of records, or drops
+        the flagged records if drop.  Records flagged by each rule are
+        counted in self.counts.
+        """
+        flags = self.flags(data)
+        mask = flags.any(axis = 1).to_numpy()
+        self.counts = {rule: int(flags[rule].sum()) for rule in self.rules}
+        self.counts["total"] = int(mask.sum())
+        logger.info(f"flagged records: {self.counts}")
+        if drop:
+            return data[~mask].reset_index(drop = True)
+        data = data.copy()
+        data["flagged"] = mask if "flagged" not in data.columns else mask | data.flagged.to_numpy(dtype = bool)
+        return data
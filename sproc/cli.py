@@ -0,0 +1,431 @@
+#!/usr/env/bin python
+
+"""
+Command line interface for batch runs over many species.
+
+    sproc fetch "Quercus alba" "Quercus rubra" --workdir oaks
+    sproc build --species-file oaks.txt --workdir oaks --jobs 8
+    sproc overlap --species-file oaks.txt --workdir oaks --jobs 8
+    sproc map --species-file oaks.txt --workdir oaks --jobs 8
+    sproc work --species-file oaks.txt --workdir /shared/oaks --jobs 8
+
+Each subcommand runs the stages it depends on.  Finished stages are
+recorded in a manifest in the workdir and skipped on the next run, so
+an interrupted batch picks up where it stopped.
+
+The work command instead queues species in workdir/queue and claims
+them one at a time, so it can be started on any number of hosts that
+share the workdir.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from loguru import logger
+from sproc.manifest import Manifest
+
+
+# Stages run per species, in order, for each subcommand.
+REQUIRES = {
+    "fetch": ("fetch",),
+    "build": ("fetch", "build"),
+    "overlap": ("fetch", "build"),
+    "map": ("fetch", "build", "map"),
+}
+
+
+def _basename(species):
+    """
+    File name used for a species in every stage directory.
+    """
+    return species.replace(" ", "_")
+
+
+def stage_output(workdir, species, stage):
+    """
+    Path to the file written by a stage for a species.
+    """
+    subdir, ext = {
+        "fetch": ("occurrences", ".csv"),
+        "build": ("ranges", ".json"),
+        "map": ("maps", ".html"),
+    }[stage]
+    return os.path.join(workdir, subdir, _basename(species) + ext)
+
+
+def _run_stage(species, stage, workdir, options):
+    """
+    Run a single stage for a species and return the output path.
+    Stage modules that sproc/__init__.py does not load are imported
+    here, so worker processes only load what they use.
+    """
+    output = stage_output(workdir, species, stage)
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+
+    # Fetch records from GBIF and cache them as CSV.
+    if stage == "fetch":
+        from sproc.fetch import Fetch
+        checkpoint = os.path.join(workdir, "checkpoints", _basename(species))
+        records = Fetch(
+            species,
+            kwargs = {"basisOfRecord": options["basis"]},
+            checkpoint = checkpoint,
+        )
+        records.data.to_csv(output, index = False)
+        shutil.rmtree(checkpoint, ignore_errors = True)
+
+    # Build the geographic range from cached records.
+    elif stage == "build":
+        from sproc.jsonify import GeographicRange, EXCLUDE_COLUMNS
+        from sproc.cache import BuildCache
+        data = pd.read_csv(stage_output(workdir, species, "fetch"))
+        if options["native"] is not None:
+            data = options["native"].apply(data, name = species)
+        if options["clean"] is not None:
+            data = options["clean"].apply(data)
+        if options["thin"]:
+            from sproc.thin import thin
+            by = [i for i in EXCLUDE_COLUMNS if i in data.columns]
+            data = thin(data, resolution = options["thin"], by = by)
+        GeographicRange(
+            data = data,
+            name = _basename(species),
+            workdir = os.path.dirname(output),
+            scalar = options["scalar"],
+            outlier_method = options["outliers"],
+            cache = BuildCache(options["cache"]) if options["cache"] else None,
+        )
+
+    # Render the interactive map to HTML.
+    elif stage == "map":
+        from sproc.imap import IMap
+        IMap(stage_output(workdir, species, "build")).imap.save(output)
+    return output
+
+
+def load_native(options, species_list):
+    """
+    Returns options with the native range source replaced by one
+    NativeRangeFilter over the ranges of every species, so the source
+    is read once per batch and workers share a single index.
+    """
+    if not isinstance(options.get("native"), str):
+        return options
+    from sproc.native import NativeRangeFilter, load_native_ranges
+    ranges = load_native_ranges(options["native"], species = list(species_list))
+    return {**options, "native": NativeRangeFilter(ranges)}
+
+
+def run_species(species, stages, workdir, options):
+    """
+    Worker function running the requested stages for one species.
+    Returns a list of (stage, status, info) tuples, stopping at the
+    first stage that fails.
+    """
+    results = []
+    for stage in stages:
+        start = time.time()
+        try:
+            output = _run_stage(species, stage, workdir, options)
+        except Exception as err:
+            results.append((stage, "failed", {"error": repr(err)}))
+            break
+        info = {"output": output, "seconds": round(time.time() - start, 2)}
+        results.append((stage, "done", info))
+    return results
+
+
+def run_batch(species_list, stages, workdir, options, jobs = 1, force = False):
+    """
+    Run stages for every species, skipping those already finished
+    according to the manifest.  Returns the list of species for which
+    all stages completed.
+    """
+    os.makedirs(workdir, exist_ok = True)
+    manifest = Manifest(os.path.join(workdir, "manifest.json"))
+
+    # Find the stages still to do for each species.
+    todo = {}
+    for species in species_list:
+        remaining = [
+            i for i in stages if force or not manifest.is_done(species, i)
+        ]
+        if remaining:
+            todo[species] = remaining
+    logger.info(
+        f"{len(species_list) - len(todo)} of {len(species_list)} species "
+        "already complete"
+    )
+
+    # Resolve all new names at once so workers find them in the cache.
+    if "fetch" in stages and todo:
+        from sproc.names import NameResolver
+        NameResolver().resolve(list(todo))
+
+    # Workers building ranges share one native range filter.
+    if "build" in stages and todo:
+        options = load_native(options, todo)
+
+    # Submit species to the pool and record results as they finish.
+    completed = [i for i in species_list if i not in todo]
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = {
+            pool.submit(run_species, species, remaining, workdir, options): species
+            for species, remaining in todo.items()
+        }
+        for future in as_completed(futures):
+            species = futures[future]
+
+            # A worker that died, or a result that failed to pickle,
+            # fails the species' first remaining stage.
+            try:
+                results = future.result()
+            except Exception as err:
+                results = [(todo[species][0], "failed", {"error": repr(err)})]
+            for stage, status, info in results:
+                manifest.mark(species, stage, status = status, **info)
+            if all(i[1] == "done" for i in results) and len(results) == len(todo[species]):
+                completed.append(species)
+                logger.info(f"finished {species}")
+            else:
+                logger.warning(f"failed {species}: {results[-1][2]['error']}")
+    return completed
+
+
+def run_queue(args, species_list, options):
+    """
+    Queue species in the shared workdir and run local workers on the
+    queue until it is empty.
+    """
+    from sproc.workqueue import WorkQueue, work
+    queue = WorkQueue(os.path.join(args.workdir, "queue"), ttl = args.ttl)
+    queue.fill(species_list, force = args.force)
+    stages = REQUIRES[args.until]
+    if "build" in stages:
+        options = load_native(options, species_list)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers = args.jobs) as pool:
+            futures = [
+                pool.submit(work, queue, args.workdir, stages, options)
+                for _ in range(args.jobs)
+            ]
+            for future in as_completed(futures):
+                future.result()
+    else:
+        work(queue, args.workdir, stages, options)
+    counts = queue.counts()
+    logger.info(f"queue: {counts}")
+    return 0 if not counts["failed"] else 1
+
+
+def run_export(args):
+    """
+    Export offline HTML maps of the range files in a workdir.
+    """
+    import glob
+    from sproc.export import export_maps
+    json_files = sorted(glob.glob(os.path.join(args.workdir, "ranges", "*.json")))
+    export_maps(
+        json_files,
+        outdir = args.outdir or os.path.join(args.workdir, "html"),
+        accuracy = args.accuracy,
+        jobs = args.jobs,
+        force = args.force,
+    )
+    return 0
+
+
+def run_genus(args):
+    """
+    Fetch a higher taxon once and build a range for each species.
+    """
+    from sproc.genus import GenusRanges
+    genus = GenusRanges(
+        args.taxon,
+        rank = args.rank,
+        workdir = os.path.join(args.workdir, "ranges"),
+        scalar = args.scalar,
+        jobs = args.jobs,
+        kwargs = {"basisOfRecord": args.basis},
+        checkpoint = os.path.join(args.workdir, "checkpoints", _basename(args.taxon)),
+    )
+    logger.info(f"built {len(genus.json_files)} of {len(genus.partitions)} ranges")
+    return 0 if len(genus.json_files) == len(genus.partitions) else 1
+
+
+def run_ingest(args):
+    """
+    Build a range for each species in an occurrence file.
+    """
+    from sproc.ingest import ingest_ranges
+    json_files = ingest_ranges(
+        args.path,
+        workdir = os.path.join(args.workdir, "ranges"),
+        scalar = args.scalar,
+        jobs = args.jobs,
+        species = args.species or None,
+    )
+    if not json_files:
+        logger.error(f"no ranges built from {args.path}")
+        return 1
+    logger.info(f"built {len(json_files)} ranges")
+    return 0
+
+
+def read_species(names, species_file):
+    """
+    Combine species names from the command line and from a file with
+    one name per line.  Blank lines and '#' comments are ignored.
+    """
+    species = list(names)
+    if species_file:
+        with open(species_file, 'r') as inf:
+            for line in inf:
+                line = line.split("#")[0].strip()
+                if line:
+                    species.append(line)
+
+    # Drop repeated names, keeping order.
+    return list(dict.fromkeys(species))
+
+
+def get_parser():
+    """
+    Build the argument parser with one subparser per command.
+    """
+    parser = argparse.ArgumentParser(
+        prog = "sproc",
+        description = "Batch fetch, build, overlap and map species ranges.",
+    )
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    for command in list(REQUIRES) + ["work"]:
+        sub = subparsers.add_parser(command)
+        sub.add_argument("species", nargs = "*", help = "species names")
+        sub.add_argument("-f", "--species-file", help = "file with one species name per line")
+        sub.add_argument("-w", "--workdir", default = ".", help = "output directory")
+        sub.add_argument("-j", "--jobs", type = int, default = 1, help = "number of worker processes")
+        sub.add_argument("--basis", default = "PRESERVED_SPECIMEN", help = "GBIF basisOfRecord filter")
+        sub.add_argument("--force", action = "store_true", help = "rerun stages already in the manifest")
+
+        # Range building options, for commands that build.
+        if command == "fetch":
+            sub.set_defaults(scalar = 2.5, outliers = "median", thin = None, native = None, clean = False, reference = [], cache = "none")
+        else:
+            sub.add_argument("--scalar", type = float, default = 2.5, help = "outlier scalar for range building")
+            sub.add_argument("--outliers", default = "median", choices = ["median", "knn", "dbscan"], help = "outlier rule for range building")
+            sub.add_argument("--thin", type = float, default = None, help = "grid cell width (degrees) for thinning records")
+            sub.add_argument("--native", default = None, help = "native range polygons: a directory of per-species GeoJSON files or one vector file with a species column")
+            sub.add_argument("--clean", action = "store_true", help = "flag records with suspect coordinates before range building")
+            sub.add_argument("--reference", action = "append", default = [], help = "CSV of extra reference points (decimalLongitude, decimalLatitude), e.g. institutions, for --clean; repeatable")
+            sub.add_argument("--cache", default = None, help = "build cache directory (default: workdir/cache, 'none' to disable)")
+
+        # Overlap options.
+        if command == "overlap":
+            sub.add_argument("--screen", type = float, default = None, help = "grid cell width (degrees) for raster screening before exact overlap")
+            sub.add_argument("--containment", action = "store_true", help = "also count each species' occurrences inside every other range")
+
+        # Shared-directory queue options.
+        if command == "work":
+            sub.add_argument("--until", default = "build", choices = ["fetch", "build", "map"], help = "last stage to run for each species")
+            sub.add_argument("--ttl", type = float, default = 600., help = "seconds without a heartbeat before a claim expires")
+
+    # Whole-taxon builds from a single fetch.
+    sub = subparsers.add_parser("genus")
+    sub.add_argument("taxon", help = "genus (or other higher taxon) name")
+    sub.add_argument("--rank", default = "genus", help = "rank of the taxon name")
+    sub.add_argument("-w", "--workdir", default = ".", help = "output directory")
+    sub.add_argument("-j", "--jobs", type = int, default = 1, help = "number of worker processes")
+    sub.add_argument("--scalar", type = float, default = 2.5, help = "outlier scalar for range building")
+    sub.add_argument("--basis", default = "PRESERVED_SPECIMEN", help = "GBIF basisOfRecord filter")
+
+    # Offline maps of every range in a workdir.
+    sub = subparsers.add_parser("export")
+    sub.add_argument("-w", "--workdir", default = ".", help = "directory with a ranges/ subdirectory")
+    sub.add_argument("-o", "--outdir", default = None, help = "export directory (default: workdir/html)")
+    sub.add_argument("-j", "--jobs", type = int, default = 1, help = "number of worker processes")
+    sub.add_argument("--accuracy", type = float, default = 0.01, help = "tolerance (degrees) of the drawn ranges")
+    sub.add_argument("--force", action = "store_true", help = "rewrite unchanged maps")
+
+    # Builds from a GBIF download or local occurrence file.
+    sub = subparsers.add_parser("ingest")
+    sub.add_argument("path", help = "Darwin Core Archive zip or CSV/TSV occurrence file")
+    sub.add_argument("species", nargs = "*", help = "species names to keep (default all)")
+    sub.add_argument("-w", "--workdir", default = ".", help = "output directory")
+    sub.add_argument("-j", "--jobs", type = int, default = 1, help = "number of worker processes")
+    sub.add_argument("--scalar", type = float, default = 2.5, help = "outlier scalar for range building")
+    return parser
+
+
+def main(argv = None):
+    """
+    Entry point for the sproc console script.
+    """
+    args = get_parser().parse_args(argv)
+    if args.command == "genus":
+        return run_genus(args)
+    if args.command == "ingest":
+        return run_ingest(args)
+    if args.command == "export":
+        return run_export(args)
+    species_list = read_species(args.species, args.species_file)
+    if not species_list:
+        logger.error("no species names given")
+        return 1
+
+    # Run the per-species stages.
+    options = {
+        "scalar": args.scalar,
+        "basis": args.basis,
+        "thin": args.thin,
+        "outliers": args.outliers,
+        "native": args.native,
+        "clean": None,
+        "cache": args.cache or os.path.join(args.workdir, "cache"),
+    }
+    if options["cache"].lower() == "none":
+        options["cache"] = None
+
+    # Read the cleaning reference tables once for all workers.
+    if args.clean:
+        from sproc.clean import CoordinateCleaner, read_reference
+        options["clean"] = CoordinateCleaner(reference = read_reference(args.reference))
+    if args.command == "work":
+        return run_queue(args, species_list, options)
+    completed = run_batch(
+        species_list,
+        REQUIRES[args.command],
+        args.workdir,
+        options,
+        jobs = args.jobs,
+        force = args.force,
+    )
+
+    # Overlap is computed across all species with a finished range.
+    if args.command == "overlap":
+        from sproc.overlap import overlap_matrix
+        files = [
+            stage_output(args.workdir, i, "build")
+            for i in species_list if i in completed
+        ]
+        pairs = None
+        if args.screen:
+            from sproc.raster import RangeGrid
+            pairs = RangeGrid(files, resolution = args.screen).candidates()
+            logger.info(f"{len(pairs)} pairs overlap on the {args.screen} degree grid")
+        outfile = os.path.join(args.workdir, "overlap.csv")
+        overlap_matrix(files, pairs = pairs).to_csv(outfile)
+        logger.info(f"wrote overlap matrix to {outfile}")
+        if args.containment:
+            from sproc.overlap import containment_matrix
+            outfile = os.path.join(args.workdir, "containment.csv")
+            containment_matrix(files).sparse.to_dense().to_csv(outfile)
+            logger.info(f"wrote point-in-range counts to {outfile}")
+    return 0 if len(completed) == len(species_list) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
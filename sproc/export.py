@@ -0,0 +1,277 @@
+#!/usr/env/bin python
+
+"""
+Export interactive maps of many range files as offline HTML.
+
+Maps in an export directory share one local copy of the Leaflet and
+folium JS/CSS assets, and each map loads its features from its own
+data file instead of inlining them:
+
+    outdir/assets/<host>/<path>   JS, CSS and the fonts they reference
+    outdir/data/<name>.js         range, occurrences and outliers
+    outdir/<name>.html            the map
+    outdir/exported.json          source hashes, to skip unchanged maps
+
+Data files are <script> includes rather than JSON, since browsers
+block requests for local files from pages opened with file://.  Only
+the basemap tiles still come from the network.
+"""
+
+import os
+import re
+import json
+import hashlib
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import folium
+import shapely.geometry
+from branca.element import MacroElement, Template
+from loguru import logger
+from sproc.globals import COLORS
+from sproc.helpers import write_json
+from sproc.overlap import _levels, select_level
+
+
+# JS and CSS used by folium maps.
+ASSETS = folium.Map.default_js + folium.Map.default_css
+
+# Modules whose code determines an exported map.
+EXPORT_MODULES = ("sproc.export", "sproc.overlap")
+
+
+def asset_path(url):
+    """
+    Path of an asset under the assets directory, mirroring its URL so
+    relative references between assets still resolve.
+    """
+    parts = urllib.parse.urlsplit(url)
+    return os.path.join(parts.netloc, parts.path.lstrip("/"))
+
+
+def write_assets(outdir, assets = ASSETS):
+    """
+    Download each (name, url) asset into outdir/assets once, along with
+    the fonts and images its CSS refers to.  Existing files are kept,
+    so an assets directory copied from a machine with network access
+    is used as is.  Returns the URLs that could not be downloaded.
+    """
+    missing = []
+    for _, url in assets:
+        try:
+            _mirror(url, os.path.join(outdir, "assets"), missing)
+        except OSError as err:
+            logger.warning(f"could not download {url}: {err!r}")
+            missing.append(url)
+    return missing
+
+
+def _mirror(url, assetdir, missing):
+    """
+    Download one asset, then any url(...) references of a CSS file.
+    References that fail are added to missing.
+    """
+    path = os.path.join(assetdir, asset_path(url))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with urllib.request.urlopen(url) as response:
+            content = response.read()
+        with open(path + ".tmp", 'wb') as outf:
+            outf.write(content)
+        os.replace(path + ".tmp", path)
+        logger.info(f"downloaded {url}")
+    if not path.endswith(".css"):
+        return
+    with open(path, 'r', encoding = "utf-8", errors = "replace") as inf:
+        css = inf.read()
+    for ref in re.findall(r"url\(\s*['\"]?([^'\")]+)['\"]?\s*\)", css):
+        if ref.startswith(("data:", "#")):
+            continue
+        ref = urllib.parse.urljoin(url, ref.split("?")[0].split("#")[0])
+        try:
+            _mirror(ref, assetdir, missing)
+        except OSError as err:
+            logger.warning(f"could not download {ref}: {err!r}")
+            missing.append(ref)
+
+
+class DataLayer(MacroElement):
+    """
+    A GeoJSON layer drawn from a part of a species' data file, which
+    sets sproc_data[name] = {"range": ..., "occurrences": ...,
+    "outliers": ...}.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        L.geoJson(sproc_data[{{ this.key|tojson }}][{{ this.part|tojson }}], {
+            pointToLayer: function(feature, latlng) {
+                return L.marker(latlng, {icon: L.AwesomeMarkers.icon(
+                    {{ this.icon|tojson }}
+                )});
+            },
+            onEachFeature: function(feature, layer) {
+                if (feature.properties.record) {
+                    layer.bindPopup(feature.properties.record);
+                }
+            }
+        }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, key, part, icon = None):
+        super().__init__()
+        self._name = "DataLayer"
+        self.key = key
+        self.part = part
+        self.icon = icon or {}
+
+
+def _data(json_file, accuracy):
+    """
+    Returns the data file content of a range file: the range feature at
+    the accuracy, and occurrence points split into occurrences and
+    outliers with only their record property.
+    """
+    with open(json_file, 'r') as inf:
+        collection = json.load(inf)
+    tolerance, geom = select_level(_levels(collection, json_file), accuracy)
+    data = {
+        "range": {"type": "Feature", "properties": {}, "geometry": shapely.geometry.mapping(geom)},
+        "occurrences": {"type": "FeatureCollection", "features": []},
+        "outliers": {"type": "FeatureCollection", "features": []},
+    }
+    for feature in collection['features']:
+        if feature['properties'].get('type') != "occurrence":
+            continue
+        part = "outliers" if feature['properties'].get('outlier') == "true" else "occurrences"
+        data[part]['features'].append({
+            "type": "Feature",
+            "geometry": feature['geometry'],
+            "properties": {"record": feature['properties'].get('record')},
+        })
+    return data, geom.bounds
+
+
+def export_map(json_file, outdir = ".", accuracy = 0.01, color = 0, tiles = "OpenStreetMap"):
+    """
+    Worker function writing the data file and HTML map of one range
+    file.  Returns the HTML path.
+    """
+    name = os.path.basename(json_file).rsplit(".json")[0]
+    data, (west, south, east, north) = _data(json_file, accuracy)
+
+    # Write the data file.
+    datafile = os.path.join(outdir, "data", name + ".js")
+    os.makedirs(os.path.dirname(datafile), exist_ok = True)
+    with open(datafile + ".tmp", 'w') as outf:
+        outf.write("var sproc_data = sproc_data || {};\n")
+        outf.write(f"sproc_data[{json.dumps(name)}] = {json.dumps(data)};\n")
+    os.replace(datafile + ".tmp", datafile)
+
+    # Build the map with local assets.
+    imap = folium.Map(tiles = tiles)
+    imap.default_js = [(i, "assets/" + asset_path(j)) for i, j in folium.Map.default_js]
+    imap.default_css = [(i, "assets/" + asset_path(j)) for i, j in folium.Map.default_css]
+    imap.get_root().header.add_child(folium.JavascriptLink(f"data/{name}.js"), name = "sproc_data")
+    color = COLORS[color % len(COLORS)]
+    layers = (
+        ("range", f"{name} bounds", None),
+        ("occurrences", f"{name} occurrences", {"markerColor": color, "icon": "info-sign"}),
+        ("outliers", f"{name} outliers", {"markerColor": color, "icon": "trash"}),
+    )
+    for part, label, icon in layers:
+        layer = folium.FeatureGroup(name = label)
+        layer.add_child(DataLayer(name, part, icon))
+        imap.add_child(layer)
+    imap.add_child(folium.LayerControl())
+    imap.fit_bounds([[south, west], [north, east]])
+
+    # Write the HTML.
+    htmlfile = os.path.join(outdir, name + ".html")
+    imap.save(htmlfile + ".tmp")
+    os.replace(htmlfile + ".tmp", htmlfile)
+    return htmlfile
+
+
+def _digest(json_file, accuracy, tiles):
+    """
+    Hash of a range file, the export settings, and the code and folium
+    version that render maps, so maps are rewritten when either changes.
+    """
+    from sproc import __version__
+    from sproc.cache import build_version
+    digest = hashlib.sha256()
+    with open(json_file, 'rb') as inf:
+        for block in iter(lambda: inf.read(1 << 20), b""):
+            digest.update(block)
+    code = build_version(EXPORT_MODULES)
+    digest.update(f"{accuracy}:{tiles}:{__version__}:{folium.__version__}:{code}".encode())
+    return digest.hexdigest()
+
+
+def export_maps(json_files, outdir = ".", accuracy = 0.01, jobs = 1, tiles = "OpenStreetMap", force = False):
+    """
+    Export maps of many range files to outdir across worker
+    processes.  Maps whose range file and settings are unchanged since
+    the last export are skipped unless force; maps written while any
+    asset is missing are not recorded, so they are redone.  Returns a
+    dict of range file to HTML file for the maps written.
+
+    Parameters
+    ----------
+    json_files: list
+        sproc GeoJSON range files.
+    outdir: str
+        Export directory.
+    accuracy: float
+        Draw the coarsest simplified range within this tolerance.
+    jobs: int
+        Number of worker processes.
+    tiles: str
+        folium basemap tiles, or None for no basemap.
+    force: bool
+        Rewrite all maps.
+    """
+    os.makedirs(outdir, exist_ok = True)
+    missing = write_assets(outdir)
+    if missing:
+        logger.warning(
+            f"{len(missing)} assets missing; maps are written but not recorded "
+            "as exported, so they are redone on the next run"
+        )
+
+    # Find maps to write.
+    manifest = os.path.join(outdir, "exported.json")
+    exported = {}
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as inf:
+            exported = json.load(inf)
+    todo = {}
+    for json_file in json_files:
+        name = os.path.basename(json_file).rsplit(".json")[0]
+        digest = _digest(json_file, accuracy, tiles)
+        if not force and exported.get(name) == digest and os.path.exists(os.path.join(outdir, name + ".html")):
+            continue
+        todo[json_file] = (name, digest)
+    logger.info(f"{len(json_files) - len(todo)} of {len(json_files)} maps unchanged")
+
+    # Render maps across processes.
+    written = {}
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = {
+            pool.submit(export_map, json_file, outdir, accuracy, tiles = tiles): json_file
+            for json_file in todo
+        }
+        for future in as_completed(futures):
+            json_file = futures[future]
+            name, digest = todo[json_file]
+            try:
+                written[json_file] = future.result()
+            except Exception as err:
+                logger.warning(f"failed {name}: {err!r}")
+                continue
+            if not missing:
+                exported[name] = digest
+    write_json(manifest, exported, indent = 2)
+    logger.info(f"wrote {len(written)} maps to {outdir}")
+    return written
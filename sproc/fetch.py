@@ -4,66 +4,260 @@
 Fetch occurrence records from GBIF REST API.
 """
 
+import os
+import glob
+import json
+import hashlib
 import pandas as pd
 import pygbif
 from loguru import logger
+from sproc.helpers import write_json
+from sproc.names import NameResolver
+from sproc.quantize import PRECISION
 
 
-# TODO: add the load GeoJSON function back? May allow users to more easily constrain to points in accepted range.
+# Columns kept from each GBIF occurrence record.
+FIELDS = [
+    "key",
+    "speciesKey",
+    "species",
+    "decimalLatitude",
+    "decimalLongitude",
+    "year",
+    "eventDate",
+    "countryCode",
+    "coordinateUncertaintyInMeters",
+    "issues",
+]
+
+# GBIF search API page size and the maximum offset it will page to.
+PAGE_LIMIT = 300
+PAGE_CAP = 100000
+
+# Bounding box used when splitting a query that exceeds PAGE_CAP.
+WORLD = {"decimalLongitude": (-180., 180.), "decimalLatitude": (-90., 90.)}
+
+
+def tidy_records(pages):
+    """
+    Returns one dataframe of the records in a list of pages, without
+    records returned by more than one query and with coordinates
+    rounded to the fixed precision used downstream.
+    """
+    data = pd.concat(pages or [pd.DataFrame([], columns = FIELDS)], ignore_index = True)
+    data = data.drop_duplicates(subset = "key").reset_index(drop = True)
+    for column in ("decimalLongitude", "decimalLatitude"):
+        data[column] = data[column].astype(float).round(PRECISION)
+    return data
 
 
 class Fetch:
     """
-    A class object to store data on species occurrence from GBIF.  
+    A class object to store data on species occurrence from GBIF.
     Users supply a species name and optionally a selection of other
     parmeters.
-    
+
     Parameters
     ----------
     sp_name: str
         ...
+    checkpoint: str
+        Optional directory in which each page of records is saved as
+        it arrives.  A request interrupted part way through resumes
+        from the last saved page when run again with the same
+        directory.
+    lazy: bool
+        If True, don't request records on init.  Use iter_pages() to
+        consume pages as they arrive, or request() to get them all.
+    resolver: names.NameResolver
+        Resolves the species name to a GBIF usage key.  Defaults to a
+        resolver with the shared on-disk name cache.
+    rank: str
+        Rank of the name, e.g. 'genus' to fetch records of all species
+        in a genus with one paged query.
     """
     def __init__(
-        self, 
-        species, 
+        self,
+        species,
         kwargs = {
-            'basisOfRecord': 'PRESERVED_SPECIMEN',            
-            }
+            'basisOfRecord': 'PRESERVED_SPECIMEN',
+            },
+        checkpoint = None,
+        lazy = False,
+        resolver = None,
+        rank = 'species',
         ):
         self.species = species
         self.data = pd.DataFrame([])
         self.kwargs = kwargs
-        self.request()
-        logger.info(f"fetched {self.data.shape[0]} occurrence records")
+        self.checkpoint = checkpoint
+        self.resolver = NameResolver() if resolver is None else resolver
+        self.rank = rank
+        if not lazy:
+            self.request()
+            logger.info(f"fetched {self.data.shape[0]} occurrence records")
 
 
     def request(self):
         """
         GBIF REST API caller.
         """
-        
+
+        # Collect all pages, keeping key columns.
+        self.data = tidy_records(list(self.iter_pages()))
+        return self.data
+
+
+    def iter_pages(self):
+        """
+        Generator over pages of records as dataframes of the FIELDS
+        columns, yielded as each page arrives.  Records may repeat
+        across pages when a query was split.
+        """
+
         # Get usage key for the queried species.
-        species_key = pygbif.species.name_backbone(
-            name = self.species,
-            rank = 'species',
-        )['usageKey']
+        species_key = self.resolver.usage_key(self.species, rank = self.rank)
+
+        # Page through each query, which may be split to stay under the cap.
+        for query in self._get_queries(species_key):
+            for page in self._pages(species_key, query):
+                yield pd.DataFrame(page, columns = FIELDS)
+
 
-        # Run a while-loop to go through all observations.  
-        data = []
+    def _search(self, species_key, query, **kwargs):
+        """
+        A single call to the GBIF occurrence search API.
+        """
+        return pygbif.occurrences.search(
+            taxonKey = species_key,
+            hasCoordinate = True,
+            **query,
+            **kwargs
+        )
+
+
+    def _get_queries(self, species_key):
+        """
+        Returns a list of query kwargs that each match fewer records
+        than the GBIF paging cap.  The plan is saved with the checkpoint
+        so that resuming does not need to count records again.
+        """
+
+        # Load a saved plan.
+        planfile = None
+        if self.checkpoint:
+            os.makedirs(self.checkpoint, exist_ok = True)
+            planfile = os.path.join(self.checkpoint, "plan.json")
+            if os.path.exists(planfile):
+                with open(planfile, 'r') as inf:
+                    return json.load(inf)
+
+        # Split the query until every part is under the cap.
+        queries = self._split_query(species_key, dict(self.kwargs))
+        if len(queries) > 1:
+            logger.info(f"split query into {len(queries)} bounding boxes")
+        if planfile:
+            write_json(planfile, queries)
+        return queries
+
+
+    def _split_query(self, species_key, query):
+        """
+        Recursively halve the bounding box of a query along its longest
+        side while it matches more records than PAGE_CAP.  Bounds are
+        inclusive, so records on a shared edge are removed later by
+        de-duplicating on key.  Splitting on space rather than year
+        keeps records that have no collection date.
+        """
+        count = self._search(species_key, query, limit = 0)['count']
+        if count <= PAGE_CAP:
+            return [query]
+
+        # Get the current box, defaulting to the whole globe.
+        bounds = {}
+        for field, default in WORLD.items():
+            if field in query:
+                bounds[field] = tuple(float(i) for i in str(query[field]).split(","))
+            else:
+                bounds[field] = default
+
+        # Stop splitting if the box is already tiny.
+        field = max(bounds, key = lambda i: bounds[i][1] - bounds[i][0])
+        low, high = bounds[field]
+        if high - low < 1e-3:
+            logger.warning(f"{count} records in {bounds}; only {PAGE_CAP} can be paged")
+            return [query]
+
+        # Split in two and recurse on each half.
+        mid = (low + high) / 2.
+        queries = []
+        for part in ((low, mid), (mid, high)):
+            subquery = dict(query)
+            for name, (lower, upper) in bounds.items():
+                subquery[name] = f"{lower},{upper}"
+            subquery[field] = f"{part[0]},{part[1]}"
+            queries.extend(self._split_query(species_key, subquery))
+        return queries
+
+
+    def _pages(self, species_key, query):
+        """
+        Generator over pages of records for one query.  Each page is a
+        list of dicts holding the FIELDS columns.  With a checkpoint
+        directory, saved pages are yielded first and paging resumes
+        from the offset after the last saved page.
+        """
+
+        # Find pages saved by an earlier run of this query.
+        pagedir = None
         curr_offset = 0
+        if self.checkpoint:
+            qhash = hashlib.md5(json.dumps(query, sort_keys = True).encode()).hexdigest()
+            pagedir = os.path.join(self.checkpoint, qhash[:12])
+            os.makedirs(pagedir, exist_ok = True)
+            for pagefile in sorted(glob.glob(os.path.join(pagedir, "page-*.json"))):
+                with open(pagefile, 'r') as inf:
+                    page = json.load(inf)
+                yield page['results']
+                if page['endOfRecords']:
+                    return
+                curr_offset = page['offset'] + page['limit']
+            if curr_offset:
+                logger.info(f"resuming from offset {curr_offset}")
+
+        # Run a while-loop to go through all observations.
         while 1:
-           
+
             # Make API request.
-            occ_records = pygbif.occurrences.search(
-                taxonKey = species_key, 
-                hasCoordinate = True,
+            occ_records = self._search(
+                species_key,
+                query,
                 offset = curr_offset,
-                **self.kwargs
+                limit = PAGE_LIMIT,
             )
 
-            # Store JSON array.
-            if occ_records:
-                data.extend(occ_records['results'])
+            # Keep only the key columns of each record, with the list
+            # of issues joined as in GBIF downloads.
+            results = [
+                {i: record.get(i) for i in FIELDS}
+                for record in occ_records['results']
+            ]
+            for record in results:
+                if isinstance(record['issues'], list):
+                    record['issues'] = ";".join(record['issues'])
+
+            # Commit the page to disk before moving on.
+            if pagedir:
+                write_json(
+                    os.path.join(pagedir, f"page-{curr_offset:09d}.json"),
+                    {
+                        "offset": curr_offset,
+                        "limit": occ_records['limit'],
+                        "endOfRecords": occ_records['endOfRecords'],
+                        "results": results,
+                    },
+                )
+            yield results
 
             # Check if querying is finished.
             if not occ_records['endOfRecords']:
@@ -71,20 +265,3 @@ class Fetch:
 
             else:
                 break
-        
-        # Normalize data.
-        self.data = pd.json_normalize(data)
-
-        # Subset key columns.
-        self.data = self.data[[
-            "key", 
-            "speciesKey",
-            "species",
-            "decimalLatitude",
-            "decimalLongitude",
-        ]]
-
-        # Drop duplicates.
-        self.data = self.data.drop_duplicates().reset_index(drop = True)
-        
-        return self.data
\ No newline at end of file
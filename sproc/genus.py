@@ -0,0 +1,133 @@
+#!/usr/env/bin python
+
+"""
+Build ranges for every species in a higher taxon from a single fetch.
+"""
+
+import shutil
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from loguru import logger
+from sproc.fetch import Fetch, tidy_records
+from sproc.jsonify import GeographicRange
+
+
+def partition(data, min_records = 3):
+    """
+    Split records by speciesKey, or by species name in files without
+    speciesKeys.  Returns a dict mapping species name to a dataframe of
+    its records, skipping records without a key and species with fewer
+    than min_records records.
+    """
+    column = "speciesKey" if data.speciesKey.notna().any() else "species"
+    data = data[data[column].notna()]
+
+    # Sort once, then cut the row order at each change of key.
+    keys = data[column].to_numpy()
+    order = np.argsort(keys, kind = "stable")
+    cuts = np.flatnonzero(keys[order][1:] != keys[order][:-1]) + 1
+
+    partitions = {}
+    for rows in np.split(order, cuts):
+        if len(rows) < min_records:
+            continue
+        part = data.iloc[rows].reset_index(drop = True)
+        partitions[part.species.iloc[0]] = part
+    return partitions
+
+
+def build_ranges(partitions, workdir = ".", scalar = 2.5, jobs = 1):
+    """
+    Build a range for each species in a dict of name to records across
+    worker processes.  Returns a dict of species name to GeoJSON file
+    for the ranges that were built.
+    """
+    json_files = {}
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = {
+            pool.submit(_build, data, name, workdir, scalar): name
+            for name, data in partitions.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                json_files[name] = future.result()
+            except Exception as err:
+                logger.warning(f"failed {name}: {err!r}")
+    return json_files
+
+
+def _build(data, name, workdir, scalar):
+    """
+    Worker function building one species range.
+    """
+    return GeographicRange(
+        data = data,
+        name = name,
+        workdir = workdir,
+        scalar = scalar,
+    ).json_file
+
+
+class GenusRanges:
+    """
+    Fetches all occurrence records of a higher taxon (e.g. a genus) in
+    one paged query, partitions each page by species as it arrives and
+    builds each species' range in parallel.  A checkpoint directory is
+    removed once the fetch completes.
+
+    Parameters
+    ----------
+    taxon: str
+        Name of the higher taxon.
+    rank: str
+        Rank of the taxon name.
+    jobs: int
+        Number of worker processes building ranges.
+    min_records: int
+        Species with fewer records are skipped.
+    """
+    def __init__(
+        self,
+        taxon,
+        rank = "genus",
+        workdir = ".",
+        scalar = 2.5,
+        jobs = 1,
+        min_records = 3,
+        kwargs = {
+            'basisOfRecord': 'PRESERVED_SPECIMEN',
+            },
+        checkpoint = None,
+        ):
+        self.taxon = taxon
+        self.workdir = workdir
+        self.scalar = scalar
+        self.jobs = jobs
+
+        # Split each page by species as it arrives, so all records are
+        # never held in one dataframe.
+        records = Fetch(taxon, kwargs = kwargs, checkpoint = checkpoint, rank = rank, lazy = True)
+        pages = {}
+        for page in records.iter_pages():
+            page = page[page.speciesKey.notna()]
+            for name, part in partition(page, min_records = 1).items():
+                pages.setdefault(name, []).append(part)
+        self.partitions = {}
+        for name in list(pages):
+            data = tidy_records(pages.pop(name))
+            if len(data) >= min_records:
+                self.partitions[name] = data
+        logger.info(f"found {len(self.partitions)} species in {taxon}")
+
+        # The fetch finished, so its saved pages are no longer needed.
+        if checkpoint:
+            shutil.rmtree(checkpoint, ignore_errors = True)
+
+        # Dict of species name to GeoJSON file.
+        self.json_files = build_ranges(
+            self.partitions,
+            workdir = self.workdir,
+            scalar = self.scalar,
+            jobs = self.jobs,
+        )
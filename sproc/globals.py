@@ -19,6 +19,19 @@ LAND = shapely.geometry.MultiPolygon(
 	geopandas.read_file(LANDCOVER_FILE).geometry.tolist()
 )
 
+# Natural Earth 1:110m countries, one feature per ISO 3166-1 alpha-2
+# countryCode, and their centroids as reference points for cleaning.
+COUNTRIES_FILE = os.path.join(
+	os.path.dirname(os.path.dirname(__file__)),
+	"geojson",
+	"countries.json",
+)
+REFERENCE_FILE = os.path.join(
+	os.path.dirname(os.path.dirname(__file__)),
+	"geojson",
+	"reference-points.csv",
+)
+
 # Colors for folium icons.
 COLORS = ['blue',
 'red',
@@ -4,7 +4,9 @@
 Utility functions.
 """
 
+import os
 import sys
+import json
 from loguru import logger
 
 
@@ -40,4 +42,15 @@ def set_loglevel(loglevel="INFO"):
         "colorize": TTY1 or TTY2,
     }]
     logger.configure(**config)
-    logger.enable("sproc")
\ No newline at end of file
+    logger.enable("sproc")
+
+
+def write_json(path, obj, **kwargs):
+    """
+    Write JSON to a temporary file and move it into place so a crash
+    never leaves a partial file behind.
+    """
+    tmpfile = f"{path}.{os.getpid()}.tmp"
+    with open(tmpfile, 'w') as outf:
+        json.dump(obj, outf, **kwargs)
+    os.replace(tmpfile, path)
@@ -9,6 +9,7 @@ import os
 import geopandas as gpd
 import folium
 from sproc.globals import COLORS
+from sproc.tiles import LEVELS, TileLayers, write_tiles
 
 
 # Make dataframes have wider columns for neatness.
@@ -22,9 +23,19 @@ class IMap:
     location: Tuple[Float,Float]
         LatLong Point as center of the map.
     zoom_start: 
+    accuracy: Float
+        Ranges are drawn from the coarsest simplified copy with a
+        tolerance within this many degrees.  None draws the exact range.
+    tiledir: str
+        Write each species' range and occurrences as tiles in this
+        directory, loaded by the map only for the current view and
+        zoom, instead of inlining all data in the map.  Save the map
+        next to tiledir, or pass tile_url.
+    tile_url: str
+        URL of tiledir as seen from the saved map; defaults to tiledir.
     """
 
-    def __init__(self, json_files):
+    def __init__(self, json_files, accuracy = 0.01, tiledir = None, tile_url = None):
 
         # Differentiate between string filepath (ex: from jsonify.GeographicRange) or list of filepaths.
         if type(json_files) == str:
@@ -34,10 +45,21 @@ class IMap:
 
         # Other variables.
         self.names = [os.path.basename(self.json_files[idx]).rsplit(".json")[0] for idx in range(len(self.json_files))]
-        self.data = [gpd.read_file(self.json_files[idx]) for idx in range(len(self.json_files))]
         self.imap = None
+        self.accuracy = accuracy
+        self.tiledir = tiledir
+        self.tile_url = tile_url if tile_url is not None else tiledir
+
+        # Tiled maps only read the files to write their tiles.
+        if self.tiledir is not None:
+            self.data = None
+            self._get_base_imap()
+            self._add_tiles()
+            self.imap.add_child(folium.LayerControl())
+            return
 
         # Run internal functions.
+        self.data = [gpd.read_file(self.json_files[idx]) for idx in range(len(self.json_files))]
         self._get_base_imap()
         self._add_poly()
         self._add_points()
@@ -77,6 +99,34 @@ class IMap:
         # attr="IGN",
 
 
+    def _add_tiles(self, levels = LEVELS):
+        """
+        Writes the tiles of each file, and adds empty range, occurrence
+        and outlier layers that the map fills from the tiles in view.
+        """
+        species = {}
+        bounds = []
+        for idx in range(len(self.json_files)):
+
+            # Write this species' tiles.
+            index = write_tiles(self.json_files[idx], self.tiledir, self.accuracy, levels)
+            bounds.append(index['bounds'])
+
+            # Make its layers, filled from the tiles.
+            layers = []
+            for label in ("bounds", "occurrences", "outliers"):
+                layer = folium.FeatureGroup(name = f"{self.names[idx]} {label}")
+                self.imap.add_child(layer)
+                layers.append(layer.get_name())
+            species[self.names[idx]] = (index, COLORS[idx % len(COLORS)], layers)
+
+        # Add the loader and fit the map to all ranges.
+        self.imap.add_child(TileLayers(self.tile_url, species))
+        if bounds:
+            west, south, east, north = zip(*bounds)
+            self.imap.fit_bounds([[min(south), min(west)], [max(north), max(east)]])
+
+
     def _add_poly(self):
         """
         Adds a MultiPolygon for the geographic range on its own layer.
@@ -90,8 +140,7 @@ class IMap:
         
             # Add the polygon to this layer.
             layer_poly.add_child(
-                folium.GeoJson(
-                    data = self.data[idx][self.data[idx]['type'] == "geographic_range"])
+                folium.GeoJson(data = self._get_range(self.data[idx]))
             )
 
             # Add this layer to the map.
@@ -102,6 +151,20 @@ class IMap:
         # self.imap.add_child(folium.LatLngPopup())
 
 
+    def _get_range(self, data):
+        """
+        Select the range feature to draw: the coarsest simplified range
+        within the requested accuracy, or the exact range.
+        """
+        exact = data[data['type'] == "geographic_range"]
+        if self.accuracy is None or 'tolerance' not in data.columns:
+            return exact
+        simple = data[(data['type'] == "simplified_range") & (data['tolerance'] <= self.accuracy)]
+        if simple.empty:
+            return exact
+        return simple[simple['tolerance'] == simple['tolerance'].max()]
+
+
     def _add_points(self):
         """
         Adds markers for occurrence points on a separate layer.
@@ -0,0 +1,149 @@
+#!/usr/env/bin python
+
+"""
+Read occurrence records from GBIF downloads and local files in chunks.
+"""
+
+import os
+import io
+import csv
+import zipfile
+import xml.etree.ElementTree as ET
+import pandas as pd
+from loguru import logger
+from sproc.fetch import FIELDS
+from sproc.genus import partition, build_ranges
+
+
+# Dtypes of the columns kept from occurrence files.
+DTYPES = {
+    "key": "int64",
+    "speciesKey": "float64",
+    "species": "object",
+    "decimalLatitude": "float64",
+    "decimalLongitude": "float64",
+    "year": "float64",
+    "eventDate": "object",
+    "countryCode": "object",
+    "coordinateUncertaintyInMeters": "float64",
+    "issues": "object",
+}
+
+# Column names used by GBIF downloads for FIELDS columns.
+ALIASES = {"gbifID": "key", "issue": "issues"}
+
+
+def _open_table(path):
+    """
+    Returns (file handle, separator, column names or None) for the
+    occurrence table in a Darwin Core Archive, a GBIF simple CSV
+    download (zip), or a plain CSV/TSV file.  Column names are None
+    when the table has its own header line.
+    """
+
+    # Plain files: guess the separator from the header line.
+    if not zipfile.is_zipfile(path):
+        handle = open(path, 'r', newline = "")
+        sep = "\t" if "\t" in handle.readline() else ","
+        handle.seek(0)
+        return handle, sep, None
+
+    archive = zipfile.ZipFile(path)
+    members = archive.namelist()
+
+    # Darwin Core Archive: the core table is described by meta.xml.
+    if "meta.xml" in members:
+        root = ET.fromstring(archive.read("meta.xml"))
+        core = next(i for i in root if i.tag.endswith("core"))
+        location = next(i for i in core.iter() if i.tag.endswith("location")).text
+        sep = core.get("fieldsTerminatedBy", "\t").encode().decode("unicode_escape")
+        names = None
+        if core.get("ignoreHeaderLines", "0") == "0":
+            fields = [i for i in core if i.tag.endswith("field") and i.get("index")]
+            names = [None] * (max(int(i.get("index")) for i in fields) + 1)
+            for field in fields:
+                names[int(field.get("index"))] = field.get("term").rsplit("/", 1)[-1]
+            names = [name or f"column{idx}" for idx, name in enumerate(names)]
+        handle = io.TextIOWrapper(archive.open(location), encoding = "utf-8", newline = "")
+        return handle, sep, names
+
+    # Simple download: one tab separated table with a header.
+    table = next(i for i in members if i.endswith((".csv", ".txt", ".tsv")))
+    handle = io.TextIOWrapper(archive.open(table), encoding = "utf-8", newline = "")
+    return handle, "\t", None
+
+
+def iter_occurrences(path, species = None, chunksize = 100000):
+    """
+    Generator over chunks of occurrence records from a file, as
+    dataframes of the fetch.FIELDS columns.  Only those columns are
+    parsed, records without coordinates are dropped, and if `species`
+    names are given only their records are kept.  Records of files
+    without a key column are numbered in file order.
+
+    Parameters
+    ----------
+    path: str
+        A zipped Darwin Core Archive or GBIF simple download, or a
+        CSV/TSV occurrence file.
+    species: list
+        Optional species names to keep.
+    chunksize: int
+        Number of rows parsed at a time.
+    """
+    handle, sep, names = _open_table(path)
+    wanted = set(FIELDS) | set(ALIASES)
+    dtypes = {**DTYPES, **{i: DTYPES[j] for i, j in ALIASES.items()}}
+
+    # GBIF tables are unquoted, so quotes inside values are literal.
+    reader = pd.read_csv(
+        handle,
+        sep = sep,
+        names = names,
+        header = None if names else "infer",
+        usecols = lambda i: i in wanted,
+        dtype = dtypes,
+        quoting = csv.QUOTE_NONE if sep == "\t" else csv.QUOTE_MINIMAL,
+        chunksize = chunksize,
+    )
+    rows = 0
+    with handle:
+        for chunk in reader:
+            chunk = chunk.rename(columns = ALIASES)
+
+            # Files without record keys are keyed by row number.
+            if "key" not in chunk.columns:
+                chunk["key"] = range(rows, rows + len(chunk))
+            rows += len(chunk)
+
+            chunk = chunk.dropna(subset = ["decimalLatitude", "decimalLongitude"])
+            if species is not None:
+                chunk = chunk[chunk.species.isin(species)]
+
+            # Columns missing from the file are empty, with FIELDS dtypes.
+            missing = {i: DTYPES[i] for i in FIELDS if i not in chunk.columns}
+            yield chunk.reindex(columns = FIELDS).astype(missing)
+
+
+def load_occurrences(path, species = None, chunksize = 100000):
+    """
+    Read the records of an occurrence file chunk by chunk, keeping only
+    the fetch.FIELDS columns (and only `species` if given), and return
+    them as one dataframe.
+    """
+    chunks = list(iter_occurrences(path, species = species, chunksize = chunksize))
+    data = pd.concat(chunks, ignore_index = True) if chunks else pd.DataFrame([], columns = FIELDS)
+    data = data.drop_duplicates(subset = "key").reset_index(drop = True)
+    data["species"] = data["species"].astype("category")
+    logger.info(f"read {data.shape[0]} occurrence records from {os.path.basename(path)}")
+    return data
+
+
+def ingest_ranges(path, workdir = ".", scalar = 2.5, jobs = 1, species = None, min_records = 3):
+    """
+    Build a range for each species in an occurrence file.  Returns a
+    dict of species name to GeoJSON file.
+    """
+    data = load_occurrences(path, species = species)
+    partitions = partition(data, min_records = min_records)
+    return build_ranges(partitions, workdir = workdir, scalar = scalar, jobs = jobs)
@@ -5,78 +5,201 @@ Build and write GeoJSON records.
 """
 
 import os
+import json
 import numpy as np
 import shapely
 from loguru import logger
 import geojson
 from sproc.globals import LAND
+from sproc.outliers import mark_outliers
+from sproc.quantize import PRECISION, quantize_coords, dequantize, unique_coords
+
+
+# Tolerances (degrees) of the simplified range copies, fine to coarse.
+TOLERANCES = (0.01, 0.05, 0.1, 0.5)
+
+# Boolean columns marking records excluded before the outlier rule,
+# set by sproc.native and sproc.clean.
+EXCLUDE_COLUMNS = ("introduced", "flagged")
 
 
 class GeographicRange:
     """
     Writes GBIF output to a GeoJSON format.
+
+    Parameters
+    ----------
+    cache: cache.BuildCache
+        Optional cache of finished builds.  On a hit the outliers,
+        range and simplified copies are loaded instead of computed, and
+        an output file written from the same build is left in place.
+    outlier_method: str
+        Outlier rule from sproc.outliers: 'median' (default), 'knn' or
+        'dbscan'.  `scalar` sets how strict it is.
+    land: shapely [Multi]Polygon
+        Land cover to clip the range to.  Defaults to the global LAND;
+        any subset of LAND that covers the points' hull gives the same
+        range more quickly.
+    native: native.NativeRangeFilter
+        Optional native range polygons.  Records outside their
+        species' native range are marked 'introduced', left out of
+        the outlier rule and the range, and written as outliers.  A
+        boolean 'introduced' column already in the data is used as is.
+    clean: clean.CoordinateCleaner
+        Optional coordinate tests.  Flagged records are handled like
+        introduced ones, as is a boolean 'flagged' column already in
+        the data.
+    precision: int
+        Decimal places of coordinates.  Points are held as int32
+        multiples of 10^-precision in place of the data's float
+        coordinate columns, de-duplicated exactly before the hull is
+        built, and written with this many decimals.
     """
 
-    def __init__(self, data, name = "test", workdir = ".", scalar = 3):
+    def __init__(
+        self,
+        data,
+        name = "test",
+        workdir = ".",
+        scalar = 3,
+        land = None,
+        outlier_method = "median",
+        cache = None,
+        native = None,
+        clean = None,
+        precision = PRECISION,
+        ):
         self.data = data.reset_index()
         self.name = name
         self.workdir = workdir
+        self.land = LAND if land is None else land
         self.json_file = (
             os.path.join(self.workdir, self.name + ".json")
             .replace(" ", "_")
         )
-        self.points = list(zip(data.decimalLongitude, data.decimalLatitude))
+        self.precision = precision
         self.feature_collection = geojson.FeatureCollection(
             features = [],
             properties = {"name": name},
         )
 
-        # Attribute to store geographic range.
+        # Attributes to store geographic range and simplified copies.
         self.georange = None
+        self.simplified = {}
+
+        # Mark records outside the native range.
+        if native is not None:
+            species = None if "species" in self.data.columns else name.replace("_", " ")
+            self.data = native.apply(self.data, name = species)
+
+        # Flag records with suspect coordinates.
+        if clean is not None:
+            self.data = clean.apply(self.data)
+
+        # Hold coordinates only as int32, in place of the float columns.
+        self.coords = quantize_coords(self.data, precision)
+        self.data = self.data.drop(columns = ["decimalLongitude", "decimalLatitude"])
+
+        # Look for a finished build of the same input.
+        build = None
+        if cache is not None:
+            # Record keys and counts are written out, so they are part
+            # of the build as well as the coordinates and exclusions.
+            arrays = [self.coords, np.asarray(self.data["key"], dtype = str)]
+            if "count" in self.data.columns:
+                arrays.append(self.data["count"].to_numpy(dtype = np.int64))
+            for column in EXCLUDE_COLUMNS:
+                if column in self.data.columns:
+                    arrays.append(self.data[column].to_numpy(dtype = bool))
+            key = cache.key(
+                arrays = arrays,
+                params = {
+                    "scalar": scalar,
+                    "outlier_method": outlier_method,
+                    "precision": precision,
+                },
+                land = land,
+            )
+            self.feature_collection['properties']['build'] = key
+            build = cache.get(key)
 
         # Run internal functions.
-        self._mark_outliers(scalar)
+        if build:
+            self.data["outlier_distance"] = build["distance"]
+            self.data["outlier_status"] = build["mask"]
+            self.georange = build["georange"]
+            self.simplified = build["simplified"]
+            if self._is_written(key):
+                logger.info(f"{self.json_file} is up to date")
+                return
+        else:
+            self._mark_outliers(scalar, outlier_method)
         self._add_points()
         self._add_polygon()
+        self._add_simplified()
+        if cache is not None and not build:
+            cache.put(
+                key,
+                self.data.outlier_distance,
+                self.data.outlier_status,
+                self.georange,
+                self.simplified,
+            )
         self.write()
 
 
     @property
-    def center(self):
+    def points(self):
         """
-        Get the center of the geographic range.
+        List of (lon, lat) tuples of all records.
         """
-        return self.georange.centroid.xy[0][0], self.georange.centroid.xy[1][0]
+        return list(zip(*dequantize(self.coords, self.precision).T.tolist()))
 
 
-    def _mark_outliers(self, scalar = 3):
+    @property
+    def records(self):
         """
-        A point is an outlier if it is >3 std Euclidean distance
-        from the median lat/long of all points.
+        Records with decimalLongitude and decimalLatitude columns at
+        the fixed precision.
         """
+        lons, lats = dequantize(self.coords, self.precision).T
+        return self.data.assign(decimalLongitude = lons, decimalLatitude = lats)
 
-        # Columns to fill.
-        self.data["outlier_distance"] = 0.
-        self.data["outlier_status"] = False
 
-        # Get median coordinate.
-        origin = shapely.geometry.Point(
-            self.data.decimalLongitude.median(), 
-            self.data.decimalLatitude.median()
-        )
+    @property
+    def center(self):
+        """
+        Get the center of the geographic range.
+        """
+        return self.georange.centroid.xy[0][0], self.georange.centroid.xy[1][0]
 
-        # Get distances from origin point.
-        for idx in self.data.index:
-            point = shapely.geometry.Point(self.points[idx])
-            self.data.loc[idx, "outlier_distance"] = point.distance(origin)
 
-        # Adds 1e-7 to prevent points from having a 0 in this column.
-        self.data["outlier_distance"] += 1e-7
+    def _mark_outliers(self, scalar = 3, method = "median"):
+        """
+        Label outliers with a rule from sproc.outliers.  By default a
+        point is an outlier if it is >3 std Euclidean distance from the
+        median lat/long of all points; 'knn' and 'dbscan' use local
+        point density instead.
+        """
 
-        # Label as outlier if >3 STD. 
-        cutoff = np.log(self.data["outlier_distance"]).std() * scalar
-        mask = np.log(self.data["outlier_distance"]) >= cutoff
-        self.data.loc[mask, "outlier_status"] = True
+        # Records already excluded are outliers and are not scored.
+        keep = np.ones(self.data.shape[0], dtype = bool)
+        for column in EXCLUDE_COLUMNS:
+            if column in self.data.columns:
+                keep &= ~self.data[column].to_numpy(dtype = bool)
+        distance = np.full(self.data.shape[0], np.nan)
+        mask = ~keep
+
+        # Score points and label outliers.
+        lons, lats = dequantize(self.coords, self.precision).T
+        distance[keep], mask[keep] = mark_outliers(
+            lons[keep],
+            lats[keep],
+            method = method,
+            scalar = scalar,
+        )
+        self.data["outlier_distance"] = distance
+        self.data["outlier_status"] = mask
         logger.info(f"dropped outliers: {mask.sum()}")
 
 
@@ -85,78 +208,113 @@ class GeographicRange:
         Store observed point occurrences.
         """
 
-        for idx in self.data.index:
+        # Columns as arrays, with coordinates at the fixed precision.
+        lons, lats = dequantize(self.coords, self.precision).T.tolist()
+        keys = self.data["key"].tolist()
+        outliers = self.data["outlier_status"].tolist()
+        counts = (
+            self.data["count"].tolist() if "count" in self.data.columns
+            else [None] * len(keys)
+        )
+
+        for key, outlier, longitude, latitude, count in zip(keys, outliers, lons, lats, counts):
 
             # Format from GBIF metadata and outlier filtering.
-            key = self.data.loc[idx, "key"]
             uri = f"https://www.gbif.org/occurrence/{key}"
-            outlier = str(self.data.loc[idx, "outlier_status"]).lower()
-            longitude = self.data.loc[idx, "decimalLongitude"]
-            latitude = self.data.loc[idx, "decimalLatitude"]
             point = (longitude, latitude)
-            geometry = geojson.Point(coordinates = point)
+            geometry = geojson.Point(coordinates = point, precision = self.precision)
 
             # Write as a feature.
-            feature = geojson.Feature(
-                geometry = geometry, 
-                properties = {
-                    "type": "occurrence",
-                    "record": f"<a href={uri} target='_blank'>{uri}</a>",
-                    "outlier": outlier,
-                    }
-            )
+            properties = {
+                "type": "occurrence",
+                "record": f"<a href={uri} target='_blank'>{uri}</a>",
+                "outlier": str(outlier).lower(),
+            }
+
+            # Thinned records represent all records in their cell.
+            if count is not None:
+                properties["count"] = int(count)
+            feature = geojson.Feature(geometry = geometry, properties = properties)
 
             # Append to feature collection.
             self.feature_collection['features'].append(feature)
-        
+
 
     def _add_polygon(self):
         """
         Computes polygon, removes water bodies, and stores.
         """
 
-        # Get points without outliers.
-        fpoints = list(zip(
-            self.data.loc[~self.data.outlier_status, "decimalLongitude"], 
-            self.data.loc[~self.data.outlier_status, "decimalLatitude"], 
-        ))
+        # Compute the range unless it was loaded from a cache.
+        if self.georange is None:
+            self.georange = self._get_range()
+
+        # Append to feature collection.
+        feature = self._range_feature(self.georange, {"type": "geographic_range"})
+        self.feature_collection['features'].append(feature)
+
+
+    def _get_range(self):
+        """
+        Returns the land-clipped convex hull of non-outlier points.
+        """
+
+        # Get distinct points without outliers.
+        fpoints, _ = unique_coords(self.coords[~self.data.outlier_status.to_numpy(dtype = bool)])
 
         # Get convex hull around points.
-        rawpoly = shapely.geometry.Polygon(fpoints)
-        conv_hull = rawpoly.convex_hull
+        conv_hull = shapely.multipoints(dequantize(fpoints, self.precision)).convex_hull
 
         # Get intersection with global LAND to remove water bodies.
-        clean_hull = conv_hull.intersection(LAND)
-
-        # Store [Multi]Polygon as the geographic range.
-        self.georange = clean_hull
-
-        # If the resulting shape is a single Polygon, write it.
-        if clean_hull.geom_type == "Polygon":
-            outline = clean_hull.boundary.coords
-            coords = list(zip(outline.xy[0], outline.xy[1]))
-            geometry = geojson.Polygon(coordinates = [coords], validate = True)
-            feature = geojson.Feature(
-                geometry = geometry, properties = {"type": "geographic_range"})
-
-        # For a MultiPolygon, combine the pieces one at a time.
-        elif clean_hull.geom_type == "MultiPolygon":
-            geometry = geojson.MultiPolygon()
-            for poly in clean_hull:
-                coords = list(zip(
-                    poly.boundary.coords.xy[0], 
-                    poly.boundary.coords.xy[1],
-                ))
-                subgeometry = geojson.Polygon([coords], validate = True)
-                geometry.coordinates.append(subgeometry.coordinates)
-            feature = geojson.Feature(
-                geometry = geometry, properties = {"type": "geographic_range"})
-        else:
-            raise ValueError(f"odd shaped hull error: {clean_hull.geom_type}")
+        clean_hull = conv_hull.intersection(self.land)
+
+        return clean_hull
+
+
+    def _add_simplified(self):
+        """
+        Stores topology-preserving simplified copies of the range at
+        each tolerance in TOLERANCES, for renderers and overlap
+        screening that don't need every coastline vertex.
+        """
+
+        # Compute the copies unless they were loaded from a cache.
+        if not self.simplified:
+            for tolerance in TOLERANCES:
+                simple = self.georange.simplify(tolerance, preserve_topology = True)
+
+                # Very small ranges can vanish at coarse tolerances.
+                if simple.is_empty:
+                    break
+                self.simplified[tolerance] = simple
 
         # Append to feature collection.
-        self.feature_collection['features'].append(feature)
-    
+        for tolerance, simple in self.simplified.items():
+            feature = self._range_feature(
+                simple, {"type": "simplified_range", "tolerance": tolerance})
+            self.feature_collection['features'].append(feature)
+
+
+    def _range_feature(self, geom, properties):
+        """
+        Returns a geojson Feature for a shapely [Multi]Polygon.
+        """
+        return range_feature(geom, properties, self.precision)
+
+
+    def _is_written(self, key):
+        """
+        True if the output file was written from the build with this key.
+        """
+        if not os.path.exists(self.json_file):
+            return False
+        with open(self.json_file, 'r') as inf:
+            try:
+                collection = json.load(inf)
+            except ValueError:
+                return False
+        return collection.get('properties', {}).get('build') == key
+
 
     def write(self):
         """
@@ -170,4 +328,34 @@ class GeographicRange:
         # Write feature collection to GeoJSON file.
         with open(self.json_file, 'w') as outf:
             outf.write(geojson.dumps(self.feature_collection, indent = 4))
-        logger.info(f"wrote data to {self.json_file}")
\ No newline at end of file
+        logger.info(f"wrote data to {self.json_file}")
+
+
+def range_feature(geom, properties, precision = PRECISION):
+    """
+    Returns a geojson Feature for a shapely [Multi]Polygon, with
+    coordinates rounded to precision decimals.
+    """
+
+    # If the shape is a single Polygon, write it.
+    if geom.geom_type == "Polygon":
+        geometry = geojson.Polygon(
+            coordinates = _rings(geom), validate = True, precision = precision)
+
+    # For a MultiPolygon, combine the pieces one at a time.
+    elif geom.geom_type == "MultiPolygon":
+        geometry = geojson.MultiPolygon()
+        for poly in geom.geoms:
+            subgeometry = geojson.Polygon(_rings(poly), validate = True, precision = precision)
+            geometry.coordinates.append(subgeometry.coordinates)
+    else:
+        raise ValueError(f"odd shaped hull error: {geom.geom_type}")
+    return geojson.Feature(geometry = geometry, properties = properties)
+
+
+def _rings(poly):
+    """
+    Exterior and interior rings of a Polygon as lists of coordinates.
+    """
+    rings = [poly.exterior] + list(poly.interiors)
+    return [list(zip(ring.coords.xy[0], ring.coords.xy[1])) for ring in rings]
@@ -0,0 +1,36 @@
+#!/usr/env/bin python
+
+"""
+Clip many hulls to land at once.
+"""
+
+import numpy as np
+import shapely
+
+
+def land_index(land):
+    """
+    Returns (STRtree, array of polygons) of the parts of a land
+    MultiPolygon, to share across calls of clip_to_land.
+    """
+    parts = np.array(land.geoms)
+    return shapely.STRtree(parts), parts
+
+
+def clip_to_land(hulls, tree, parts):
+    """
+    Clips an array of hulls to land.  Only the land polygons that each
+    hull touches, found with one bulk STRtree query, are intersected.
+    Returns an array of MultiPolygons.
+    """
+    hull_idx, part_idx = tree.query(hulls, predicate = "intersects")
+    pieces = shapely.intersection(hulls[hull_idx], parts[part_idx])
+
+    # Keep the polygon parts of each piece, labelled by hull.
+    polys, counts = shapely.get_parts(pieces, return_index = True)
+    keep = shapely.get_type_id(polys) == 3
+    return shapely.multipolygons(
+        polys[keep],
+        indices = hull_idx[counts[keep]],
+        out = np.array([shapely.MultiPolygon()] * len(hulls), dtype = object),
+    )
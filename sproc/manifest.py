@@ -0,0 +1,61 @@
+#!/usr/env/bin python
+
+"""
+A run manifest recording which species have finished which stages.
+"""
+
+import os
+import json
+import time
+from sproc.helpers import write_json
+
+
+class Manifest:
+    """
+    Stores the status of each (species, stage) pair of a batch run in a
+    JSON file in the workdir.  The file is rewritten atomically after
+    every update so an interrupted run can be resumed from it.
+
+    Parameters
+    ----------
+    path: str
+        Location of the JSON manifest file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+        # Load an existing manifest to resume from.
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as inf:
+                self.entries = json.load(inf)
+
+
+    def is_done(self, species, stage):
+        """
+        Returns True if the stage finished for this species and its
+        output file still exists.
+        """
+        entry = self.entries.get(species, {}).get(stage)
+        if not entry or entry['status'] != "done":
+            return False
+        return entry.get('output') is None or os.path.exists(entry['output'])
+
+
+    def mark(self, species, stage, status = "done", **info):
+        """
+        Record the status of a stage for a species and save the manifest.
+        """
+        self.entries.setdefault(species, {})[stage] = dict(
+            status = status,
+            time = time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **info
+        )
+        self.write()
+
+
+    def write(self):
+        """
+        Write the manifest to a temporary file and move it into place.
+        """
+        write_json(self.path, self.entries, indent = 4)
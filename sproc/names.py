@@ -0,0 +1,113 @@
+#!/usr/env/bin python
+
+"""
+Resolve taxon names to GBIF backbone usage keys, with an on-disk cache.
+"""
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from sproc.helpers import write_json
+
+
+# Default location of the name cache shared by all runs.
+NAMES_FILE = os.path.join(os.path.expanduser("~"), ".cache", "sproc", "names.json")
+
+# Fields kept from each GBIF backbone match.
+NAME_FIELDS = [
+    "usageKey",
+    "acceptedUsageKey",
+    "scientificName",
+    "rank",
+    "status",
+    "synonym",
+    "matchType",
+]
+
+
+def _gbif_backbone(name, rank):
+    """
+    Default backend: a single GBIF species backbone match.
+    """
+    import pygbif
+    return pygbif.species.name_backbone(name = name, rank = rank)
+
+
+class NameResolver:
+    """
+    Resolves names to GBIF backbone matches.  Matches are kept in a
+    JSON file so repeat lookups don't hit the API, and names not yet
+    in the file are matched concurrently.
+
+    Parameters
+    ----------
+    path: str
+        JSON file storing matches.  None keeps them in memory only.
+    backend: callable
+        Function of (name, rank) returning a GBIF backbone match dict.
+        Replace it with a local stand-in to resolve names offline.
+    jobs: int
+        Number of threads making backend requests.
+    """
+    def __init__(self, path = NAMES_FILE, backend = _gbif_backbone, jobs = 8):
+        self.path = path
+        self.backend = backend
+        self.jobs = jobs
+        self.names = {}
+        self._lock = threading.Lock()
+
+        # Load matches from earlier runs.
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'r') as inf:
+                self.names = json.load(inf)
+
+
+    def resolve(self, names, rank = "species"):
+        """
+        Returns a dict mapping each name to its match, with fields from
+        NAME_FIELDS.  Names without a match map to a dict whose
+        usageKey is None and are not stored.
+        """
+        keys = {name: f"{rank}:{name}" for name in names}
+        missing = [name for name, key in keys.items() if key not in self.names]
+
+        # Match the new names concurrently.
+        if missing:
+            with ThreadPoolExecutor(max_workers = self.jobs) as pool:
+                matches = list(pool.map(lambda i: self.backend(i, rank), missing))
+            found = 0
+            with self._lock:
+                for name, match in zip(missing, matches):
+                    if match.get("usageKey") is not None:
+                        self.names[keys[name]] = {i: match.get(i) for i in NAME_FIELDS}
+                        found += 1
+                if found and self.path:
+                    self._write()
+            logger.info(f"resolved {found} of {len(missing)} new names")
+
+        empty = dict.fromkeys(NAME_FIELDS)
+        return {name: self.names.get(key, empty) for name, key in keys.items()}
+
+
+    def usage_key(self, name, rank = "species"):
+        """
+        Returns the usage key for a single name.
+        """
+        key = self.resolve([name], rank = rank)[name]["usageKey"]
+        if key is None:
+            raise ValueError(f"no GBIF backbone match for {rank} '{name}'")
+        return key
+
+
+    def _write(self):
+        """
+        Merge matches into the file, keeping any that another process
+        added since it was loaded.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as inf:
+                self.names = {**json.load(inf), **self.names}
+        write_json(self.path, self.names, indent = 1)
@@ -0,0 +1,120 @@
+#!/usr/env/bin python
+
+"""
+Mark occurrences that fall outside expert (native) range polygons.
+"""
+
+import os
+import glob
+import numpy as np
+import shapely
+from loguru import logger
+
+
+def load_native_ranges(source, species = None, name_field = "species"):
+    """
+    Returns a dict of species name to native range geometry.
+
+    Parameters
+    ----------
+    source: str
+        A directory of GeoJSON files named by species (e.g.
+        Quercus_alba.json), or one vector file (GeoJSON, shapefile,
+        GeoPackage) with a column of species names.
+    species: list
+        Optional species names to load.
+    name_field: str
+        Column holding species names in a single vector file.
+    """
+    import geopandas
+    ranges = {}
+
+    # One file per species, named with underscores.
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "*.*json"))):
+            name = os.path.basename(path).rsplit(".", 1)[0].replace("_", " ")
+            if species is not None and name not in species:
+                continue
+            frame = geopandas.read_file(path)
+            polys = frame.geometry[frame.geom_type.isin(["Polygon", "MultiPolygon"])]
+            if len(polys):
+                ranges[name] = shapely.union_all(polys.to_numpy())
+
+    # One file with a row (or more) per species.
+    else:
+        frame = geopandas.read_file(source)
+        if species is not None:
+            frame = frame[frame[name_field].isin(species)]
+        for name, rows in frame.groupby(name_field):
+            ranges[name] = shapely.union_all(rows.geometry.to_numpy())
+    logger.info(f"loaded native ranges for {len(ranges)} species")
+    return ranges
+
+
+class NativeRangeFilter:
+    """
+    Tests occurrences of many species against their native range
+    polygons at once.  The polygons of all species are split into parts
+    and held in one STRtree, so a single bulk query finds every point
+    that lies in a part of its own species' range.
+
+    Parameters
+    ----------
+    ranges: dict
+        Species name to native range geometry, e.g. from
+        load_native_ranges().
+    buffer: float
+        Distance (degrees) added around every range, to keep records
+        just outside a coarsely drawn range.
+    """
+    def __init__(self, ranges, buffer = 0.):
+        self.names = np.array(list(ranges), dtype = object)
+        geoms = np.array(list(ranges.values()), dtype = object)
+        if buffer:
+            geoms = shapely.buffer(geoms, buffer)
+
+        # Polygon parts of every range, labelled by species.
+        self.parts, owner = shapely.get_parts(geoms, return_index = True)
+        self.owner = self.names[owner]
+        self.tree = shapely.STRtree(self.parts)
+
+
+    def introduced(self, lons, lats, species):
+        """
+        Returns a boolean array marking points outside the native range
+        of their species.  Points of species without a native range are
+        not marked.
+
+        Parameters
+        ----------
+        lons, lats: array
+            Point coordinates.
+        species: array or str
+            Species name of each point, or one name for all points.
+        """
+        points = shapely.points(np.asarray(lons, dtype = float), np.asarray(lats, dtype = float))
+        species = np.broadcast_to(np.asarray(species, dtype = object), points.shape)
+
+        # Bulk query, then keep hits on a part of the point's own species.
+        point_idx, part_idx = self.tree.query(points, predicate = "intersects")
+        own = species[point_idx] == self.owner[part_idx]
+        native = np.zeros(len(points), dtype = bool)
+        native[point_idx[own]] = True
+        known = np.isin(species, self.names)
+        return known & ~native
+
+
+    def apply(self, data, name = None, drop = False):
+        """
+        Adds an 'introduced' column to a dataframe of records, or drops
+        those records if drop.  Species names come from the species
+        column unless name is given.
+        """
+        species = name if name is not None else data.species.to_numpy(dtype = object)
+        mask = self.introduced(data.decimalLongitude, data.decimalLatitude, species)
+        logger.info(f"records outside native ranges: {mask.sum()}")
+        if drop:
+            return data[~mask].reset_index(drop = True)
+        data = data.copy()
+        data["introduced"] = mask
+        return data
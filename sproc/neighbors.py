@@ -0,0 +1,125 @@
+#!/usr/env/bin python
+
+"""
+Distances between occurrences of different species.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+# Mean radius of the Earth in kilometers.
+EARTH_RADIUS = 6371.0088
+
+
+def unit_vectors(lons, lats):
+    """
+    Returns an (n, 3) array of 3-D unit vectors for lon/lat in degrees.
+    Straight-line (chord) distance between unit vectors increases with
+    great-circle distance, so a KD-tree over them finds true nearest
+    neighbors on the sphere.
+    """
+    lons = np.radians(np.asarray(lons, dtype = float))
+    lats = np.radians(np.asarray(lats, dtype = float))
+    coslat = np.cos(lats)
+    return np.column_stack([coslat * np.cos(lons), coslat * np.sin(lons), np.sin(lats)])
+
+
+def chord_to_km(chord):
+    """
+    Great-circle distance in km for a chord length on the unit sphere.
+    """
+    return 2. * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord) / 2., 0., 1.))
+
+
+def km_to_chord(km):
+    """
+    Chord length on the unit sphere for a great-circle distance in km.
+    """
+    return 2. * np.sin(np.minimum(np.asarray(km) / EARTH_RADIUS, np.pi) / 2.)
+
+
+def load_points(source, outliers = False):
+    """
+    Returns (name, lons, lats) of the occurrences in a sproc GeoJSON
+    file or a Sproc object, without outliers unless `outliers`.
+    """
+
+    # Sproc (or GeographicRange) objects carry their records.
+    if hasattr(source, "data"):
+        data = source.data
+        if not outliers:
+            data = data[~data.outlier_status]
+        name = getattr(source, "species", getattr(source, "name", None))
+        return name, data.decimalLongitude.to_numpy(), data.decimalLatitude.to_numpy()
+
+    # Otherwise read the occurrence features from the file.
+    with open(source, 'r') as inf:
+        collection = json.load(inf)
+    coords = [
+        i['geometry']['coordinates']
+        for i in collection['features']
+        if i['properties'].get('type') == "occurrence"
+        and (outliers or i['properties'].get('outlier') == "false")
+    ]
+    coords = np.array(coords, dtype = float).reshape(-1, 2)
+    name = os.path.basename(source).rsplit(".json")[0]
+    return name, coords[:, 0], coords[:, 1]
+
+
+def nearest_heterospecific(sources, radius = 10., outliers = False, workers = -1):
+    """
+    For every occurrence of every species, find the nearest occurrence
+    of any other species and count the other species' occurrences
+    within `radius` km.  Each species gets one KD-tree over unit
+    vectors, and all points are queried against it in bulk.
+
+    Parameters
+    ----------
+    sources: list
+        Two or more sproc GeoJSON files or Sproc objects.
+    radius: float
+        Radius in km for counting heterospecific neighbors.
+    outliers: bool
+        Include points marked as outliers.
+    workers: int
+        Threads used by each KD-tree query (-1 for all cores).
+
+    Returns a dataframe with one row per point: species, lon, lat,
+    nearest_species, distance_km and count_within.
+    """
+    points = [load_points(i, outliers = outliers) for i in sources]
+    vectors = [unit_vectors(lons, lats) for _, lons, lats in points]
+    trees = [cKDTree(i) for i in vectors]
+    chord = km_to_chord(radius)
+
+    frames = []
+    for idx, (name, lons, lats) in enumerate(points):
+        best = np.full(len(lons), np.inf)
+        nearest = np.full(len(lons), -1)
+        count = np.zeros(len(lons), dtype = np.int64)
+
+        # Query every other species' tree with all of this species' points.
+        for jdx, tree in enumerate(trees):
+            if jdx == idx or tree.n == 0 or not len(lons):
+                continue
+            dist, _ = tree.query(vectors[idx], k = 1, workers = workers)
+            closer = dist < best
+            best[closer] = dist[closer]
+            nearest[closer] = jdx
+            count += tree.query_ball_point(
+                vectors[idx], chord, return_length = True, workers = workers)
+
+        names = np.array([i[0] for i in points] + [None], dtype = object)
+        frames.append(pd.DataFrame({
+            "species": name,
+            "lon": lons,
+            "lat": lats,
+            "nearest_species": names[nearest],
+            "distance_km": np.where(nearest >= 0, chord_to_km(best), np.inf),
+            "count_within": count,
+        }))
+    return pd.concat(frames, ignore_index = True)
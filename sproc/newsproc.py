@@ -7,10 +7,20 @@ The main API interface
 from sproc.fetch import Fetch
 from sproc.jsonify import GeographicRange
 from sproc.imap import IMap
+from sproc.thin import thin
+from sproc.stream import StreamingRange, stream_pages
 
 
 class Sproc:
-    def __init__(self, species, workdir=".", scalar=2.5):
+    def __init__(
+        self,
+        species,
+        workdir=".",
+        scalar=2.5,
+        thin=None,
+        stream=False,
+        outlier_method="median",
+        ):
         # Store inputs.
         self.species = species
         self.workdir = workdir
@@ -23,6 +33,15 @@ class Sproc:
         # Number of occurrences for species.
         self.occs = None
 
+        # Optional grid cell width (degrees) for thinning records.
+        self.thin = thin
+
+        # Build the hull and land subset while pages are still arriving.
+        self.stream = stream
+
+        # Outlier rule, see sproc.outliers.
+        self.outlier_method = outlier_method
+
         # Generate results.
         self._run(scalar)
 
@@ -31,19 +50,41 @@ class Sproc:
         """
         Run internal functions.
         """
-        records = Fetch(species = self.species)
+        land = None
+        if self.stream:
+            records = Fetch(species = self.species, lazy = True)
+            consumer = stream_pages(records, StreamingRange())
+            data = consumer.data
+            land = consumer.land_subset
+        else:
+            records = Fetch(species = self.species)
+            data = records.data
+        if self.thin:
+            data = thin(data, resolution = self.thin)
         georange = GeographicRange(
-            data = records.data, 
+            data = data, 
             name = self.species,
             workdir = self.workdir,
             scalar = outlier_scalar,
+            land = land,
+            outlier_method = self.outlier_method,
         )
-        self.data = georange.data
+        self.data = georange.records
         self.georange = georange.georange
         self.map = IMap(georange.json_file).imap
         self.occs = self.data.shape[0]
 
 
+    def sweep(self, scalars = (1.5, 2, 2.5, 3, 3.5, 4)):
+        """
+        Returns a dataframe of outlier count, hull area and land area
+        for each outlier scalar, from this species' records without
+        fetching or writing anything.
+        """
+        from sproc.sweep import OutlierSweep
+        return OutlierSweep(self.data, scalars, outlier_method = self.outlier_method).table
+
+
     def __repr__(self):
         _data = [
             "<Sproc ",
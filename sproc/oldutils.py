@@ -291,30 +291,16 @@ def world_plot(
 
 def get_cartesian(lats, lons):
     """
-    Transform latitude and longitude coordinates into (roughly) Cartesian equivalents.
+    Transform latitude and longitude coordinates (degrees) into Cartesian
+    equivalents in kilometers.  See sproc.neighbors.unit_vectors.
     """
-    import numpy as np
-    import math
-
-    # Create three empty arrays.
-    cart_y = np.zeros((len(lats), 1))
-    cart_x = np.zeros((len(lats), 1))
-    cart_z = np.zeros((len(lats), 1))
-
-    # Set R, the approximate radius of the Earth in kilometers.
-    R = 6371
-
-    # Calculate XYZ coordinates.
-    for idx in range(len(lats)):
-        Y = R * math.cos(lats[idx]) * math.sin(lons[idx])
-        X = R * math.cos(lats[idx]) * math.cos(lons[idx])
-        Z = R * math.sin(lats[idx])
-        cart_y[idx] = Y
-        cart_x[idx] = X
-        cart_z[idx] = Z
-
-    # Return XY coordinates.
-    return cart_y, cart_x, cart_z
+    from sproc.neighbors import unit_vectors, EARTH_RADIUS
+
+    # Scale unit vectors by the radius of the Earth.
+    xyz = unit_vectors(lons, lats) * EARTH_RADIUS
+
+    # Return YXZ coordinates as column arrays.
+    return xyz[:, 1:2], xyz[:, 0:1], xyz[:, 2:3]
      
 
 def calculate_overlay(lats1, lons1, lats2, lons2):
@@ -0,0 +1,127 @@
+#!/usr/env/bin python
+
+"""
+Outlier rules for occurrence points.  Each returns a per-point score
+and a boolean outlier mask.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sproc.neighbors import unit_vectors, chord_to_km, km_to_chord
+
+
+def median_scores(lons, lats):
+    """
+    Euclidean distance (degrees) of each point from the median
+    lat/long of all points.
+    """
+    lons = np.asarray(lons, dtype = float)
+    lats = np.asarray(lats, dtype = float)
+
+    # Adds 1e-7 to prevent points from having a 0 distance.
+    return np.hypot(lons - np.median(lons), lats - np.median(lats)) + 1e-7
+
+
+def median_threshold(distance, scalar = 3):
+    """
+    Outlier mask of the median rule: log distance >= scalar times the
+    std of the log distances.  An array of scalars gives one mask row
+    per scalar.
+    """
+    logdist = np.log(distance)
+    return logdist >= logdist.std(ddof = 1) * np.asarray(scalar, dtype = float)[..., None]
+
+
+def median_outliers(lons, lats, scalar = 3):
+    """
+    A point is an outlier if its log Euclidean distance (degrees) from
+    the median lat/long of all points is >= scalar times the std of
+    the log distances.
+    """
+    distance = median_scores(lons, lats)
+    return distance, median_threshold(distance, scalar)
+
+
+def _kth_neighbor_km(vectors, k):
+    """
+    Great-circle distance (km) from each point to its k-th nearest
+    other point, using a KD-tree over unit vectors.
+    """
+    k = min(k, len(vectors) - 1)
+    dist, _ = cKDTree(vectors).query(vectors, k = k + 1, workers = -1)
+    return chord_to_km(dist[:, -1])
+
+
+def knn_scores(lons, lats, k = 10):
+    """
+    Great-circle distance (km) from each point to its k-th nearest
+    neighbor.
+    """
+    return _kth_neighbor_km(unit_vectors(lons, lats), k) + 1e-7
+
+
+def knn_threshold(distance, scalar = 3):
+    """
+    Outlier mask of the knn rule: log distance more than scalar stds
+    above the mean.  An array of scalars gives one mask row per
+    scalar.
+    """
+    logdist = np.log(distance)
+    return logdist > logdist.mean() + np.asarray(scalar, dtype = float)[..., None] * logdist.std()
+
+
+def knn_outliers(lons, lats, scalar = 3, k = 10):
+    """
+    A point is an outlier if the log great-circle distance to its k-th
+    nearest neighbor is more than scalar stds above the mean.  Points
+    in a separate but dense population are not flagged, unlike with
+    the median rule, while isolated points inside the range are.
+    """
+    if len(lons) <= k:
+        return np.zeros(len(lons)), np.zeros(len(lons), dtype = bool)
+    distance = knn_scores(lons, lats, k)
+    return distance, knn_threshold(distance, scalar)
+
+
+def dbscan_outliers(lons, lats, scalar = 3, k = 10, eps = None):
+    """
+    DBSCAN noise points: a point is a core point if at least k other
+    points lie within eps km, and an outlier if it is neither a core
+    point nor within eps km of one.  By default eps is scalar times the
+    median distance to the k-th nearest neighbor.
+    """
+    if len(lons) <= k:
+        return np.zeros(len(lons)), np.zeros(len(lons), dtype = bool)
+    vectors = unit_vectors(lons, lats)
+    if eps is None:
+        eps = scalar * np.median(_kth_neighbor_km(vectors, k))
+    chord = km_to_chord(eps)
+
+    # Count neighbors within eps to find core points.
+    tree = cKDTree(vectors)
+    counts = tree.query_ball_point(vectors, chord, return_length = True, workers = -1)
+    core = counts > k
+
+    # Distance from every point to its nearest core point.
+    distance = np.full(len(vectors), np.inf)
+    if core.any():
+        dist, _ = cKDTree(vectors[core]).query(vectors, k = 1, workers = -1)
+        distance = chord_to_km(dist)
+    return distance, ~core & (distance > eps)
+
+
+# Outlier rules selectable by name.
+METHODS = {
+    "median": median_outliers,
+    "knn": knn_outliers,
+    "dbscan": dbscan_outliers,
+}
+
+
+def mark_outliers(lons, lats, method = "median", scalar = 3, **kwargs):
+    """
+    Apply the outlier rule named by method.  Returns (score, mask).
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown outlier method: {method}")
+    return METHODS[method](lons, lats, scalar = scalar, **kwargs)
@@ -0,0 +1,158 @@
+#!/usr/env/bin python
+
+"""
+Calculate overlap between geographic ranges in sproc GeoJSON files.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import shapely
+import shapely.geometry
+from scipy import sparse
+
+
+def load_levels(json_file):
+    """
+    Load the geographic range and its simplified copies from a sproc
+    GeoJSON file written by jsonify.GeographicRange.  Returns a dict
+    mapping tolerance to [Multi]Polygon, with the exact range at 0.
+    """
+
+    # Read the feature collection without building a dataframe of points.
+    with open(json_file, 'r') as inf:
+        collection = json.load(inf)
+    return _levels(collection, json_file)
+
+
+def _levels(collection, json_file):
+    """
+    Exact and simplified ranges of a loaded feature collection.
+    """
+    levels = {}
+    for feature in collection['features']:
+        ftype = feature['properties'].get('type')
+        if ftype == "geographic_range":
+            levels[0.] = shapely.geometry.shape(feature['geometry'])
+        elif ftype == "simplified_range":
+            tolerance = feature['properties']['tolerance']
+            levels[tolerance] = shapely.geometry.shape(feature['geometry'])
+    if 0. not in levels:
+        raise ValueError(f"no geographic_range feature in {json_file}")
+    return levels
+
+
+def select_level(levels, accuracy = None):
+    """
+    Returns (tolerance, geometry) for the coarsest level whose
+    tolerance is within `accuracy` degrees, or the exact range if
+    accuracy is None.
+    """
+    if accuracy is None:
+        return 0., levels[0.]
+    tolerance = max(i for i in levels if i <= accuracy)
+    return tolerance, levels[tolerance]
+
+
+def load_range(json_file, accuracy = None):
+    """
+    Load the geographic range [Multi]Polygon from a sproc GeoJSON file,
+    optionally at the coarsest simplified level within `accuracy`.
+    """
+    return select_level(load_levels(json_file), accuracy)[1]
+
+
+def overlap_matrix(json_files, accuracy = None, screen = 0.5, pairs = None):
+    """
+    Returns a square dataframe of pairwise range overlap.  Each cell is
+    the fraction of the row species' range area that intersects the
+    column species' range.
+
+    Pairs are first screened on the simplified ranges at tolerance
+    `screen`: a simplified range is within its tolerance of the exact
+    one, so ranges further apart than the two tolerances cannot
+    overlap.  Remaining pairs are intersected at `accuracy`, which is
+    the exact geometry by default.  If `pairs` of (i, j) indices are
+    given, e.g. from raster.RangeGrid.candidates, only those pairs are
+    intersected and all others are left at zero.
+    """
+
+    # Get names and ranges from files.
+    names = [os.path.basename(i).rsplit(".json")[0] for i in json_files]
+    levels = [load_levels(i) for i in json_files]
+    coarse = [select_level(i, screen) for i in levels]
+    ranges = [select_level(i, accuracy)[1] for i in levels]
+    areas = np.array([i.area for i in ranges])
+
+    # Default to every pair.
+    if pairs is None:
+        pairs = [
+            (idx, jdx)
+            for idx in range(len(ranges))
+            for jdx in range(idx + 1, len(ranges))
+        ]
+
+    # Fill the matrix, computing each intersection only once.
+    matrix = np.eye(len(ranges))
+    for idx, jdx in pairs:
+        (itol, igeom), (jtol, jgeom) = coarse[idx], coarse[jdx]
+        if igeom.distance(jgeom) > itol + jtol:
+            continue
+        if not ranges[idx].intersects(ranges[jdx]):
+            continue
+        shared = ranges[idx].intersection(ranges[jdx]).area
+        matrix[idx, jdx] = shared / areas[idx] if areas[idx] else 0.
+        matrix[jdx, idx] = shared / areas[jdx] if areas[jdx] else 0.
+    return pd.DataFrame(matrix, index = names, columns = names)
+
+
+def containment_matrix(json_files, accuracy = None, outliers = False):
+    """
+    Returns a sparse square dataframe of point-in-range counts: each
+    cell is the number of the row species' occurrences that lie in the
+    column species' range (including its boundary).
+
+    All occurrences of all files are gathered into one array, and the
+    polygon parts of all ranges into one STRtree, so every point is
+    tested with a single bulk query.
+
+    Parameters
+    ----------
+    json_files: list
+        sproc GeoJSON files.
+    accuracy: float
+        Use the coarsest simplified ranges within this tolerance
+        (degrees) instead of the exact ranges.
+    outliers: bool
+        Include occurrences marked as outliers.
+    """
+    names = [os.path.basename(i).rsplit(".json")[0] for i in json_files]
+
+    # Get ranges and occurrence points from each file in one read.
+    ranges = []
+    coords = []
+    for json_file in json_files:
+        with open(json_file, 'r') as inf:
+            collection = json.load(inf)
+        ranges.append(select_level(_levels(collection, json_file), accuracy)[1])
+        coords.append(np.array([
+            i['geometry']['coordinates']
+            for i in collection['features']
+            if i['properties'].get('type') == "occurrence"
+            and (outliers or i['properties'].get('outlier') == "false")
+        ], dtype = float).reshape(-1, 2))
+    owner = np.repeat(np.arange(len(coords)), [len(i) for i in coords])
+    points = shapely.points(np.vstack(coords))
+
+    # Query all points against the parts of all ranges.
+    parts, part_owner = shapely.get_parts(np.array(ranges, dtype = object), return_index = True)
+    point_idx, part_idx = shapely.STRtree(parts).query(points, predicate = "intersects")
+
+    # A point on a border shared by two parts of one range counts once.
+    hits = np.unique(np.column_stack([point_idx, part_owner[part_idx]]), axis = 0)
+    matrix = sparse.coo_matrix(
+        (np.ones(len(hits), dtype = np.int64), (owner[hits[:, 0]], hits[:, 1])),
+        shape = (len(names), len(names)),
+    ).tocsr()
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index = names, columns = names)
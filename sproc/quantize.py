@@ -0,0 +1,51 @@
+#!/usr/env/bin python
+
+"""
+Fixed-precision integer coordinates.
+"""
+
+import numpy as np
+
+
+# Decimal places kept: 6 is micro-degrees (~0.1 m), the precision
+# GBIF and the GeoJSON writer use.
+PRECISION = 6
+
+
+def quantize(values, precision = PRECISION):
+    """
+    Returns degrees as int32 multiples of 10^-precision.  int32 holds
+    +/-180 degrees for precision up to 7.
+    """
+    if precision > 7:
+        raise ValueError("int32 coordinates hold at most 7 decimal places")
+    return np.rint(np.asarray(values, dtype = float) * 10 ** precision).astype(np.int32)
+
+
+def dequantize(values, precision = PRECISION):
+    """
+    Returns int32 coordinates as float degrees.
+    """
+    return np.asarray(values, dtype = np.int32) / 10 ** precision
+
+
+def quantize_coords(data, precision = PRECISION):
+    """
+    Returns an (n, 2) int32 array of the lon/lat of a dataframe of
+    records.
+    """
+    return np.column_stack([
+        quantize(data.decimalLongitude, precision),
+        quantize(data.decimalLatitude, precision),
+    ])
+
+
+def unique_coords(coords):
+    """
+    Returns (unique rows, index of each row's first occurrence) of an
+    (n, 2) int32 coordinate array.  Each row is packed into one int64
+    so the comparison is exact and runs as a 1-D sort.
+    """
+    packed = coords[:, 0].astype(np.int64) << 32 | coords[:, 1].astype(np.int64) & 0xFFFFFFFF
+    _, first = np.unique(packed, return_index = True)
+    return coords[first], first
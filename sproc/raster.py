@@ -0,0 +1,145 @@
+#!/usr/env/bin python
+
+"""
+Rasterize geographic ranges onto a shared global grid of bits.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from loguru import logger
+from sproc.overlap import load_levels, select_level
+
+
+class RangeGrid:
+    """
+    Burns the geographic_range of each sproc GeoJSON file onto a shared
+    global lon/lat grid.  Each species is one row of packed bits (one
+    bit per cell, set if the cell center is inside the range), so the
+    cells shared by every pair of species can be counted in bulk.
+
+    Parameters
+    ----------
+    json_files: list
+        sproc GeoJSON files.
+    resolution: float
+        Cell width in degrees.
+    all_touched: bool
+        Also set every cell a range touches, testing the cells along
+        its exact boundary, so that any two intersecting ranges share
+        at least one cell.  Use this when screening pairs for exact
+        overlap; turn it off for less biased approximate overlap
+        fractions.
+    """
+    def __init__(self, json_files, resolution = 0.25, all_touched = True):
+        self.json_files = json_files
+        self.all_touched = all_touched
+        self.names = [os.path.basename(i).rsplit(".json")[0] for i in json_files]
+        self.resolution = resolution
+        self.nrows = int(np.ceil(180. / resolution))
+        self.ncols = int(np.ceil(360. / resolution))
+
+        # Packed bits, one row per species.
+        nbytes = int(np.ceil(self.nrows * self.ncols / 8))
+        self.bits = np.zeros((len(json_files), nbytes), dtype = np.uint8)
+
+        # Placeholder for the cell count matrix.
+        self._counts = None
+
+        # Burn each range.  Without all_touched a simplified copy finer
+        # than a cell will do; a screen needs the exact edge, since
+        # simplifying can move it off a cell it touches.
+        accuracy = None if all_touched else resolution / 2
+        for idx, json_file in enumerate(json_files):
+            levels = load_levels(json_file)
+            self.bits[idx] = np.packbits(self.burn(select_level(levels, accuracy)[1]))
+        logger.info(f"rasterized {len(json_files)} ranges at {resolution} degrees")
+
+
+    def burn(self, geom):
+        """
+        Returns a flat boolean array over all grid cells that is True
+        for cells whose center falls inside geom (or that it touches,
+        with all_touched).  Only the cells in the geometry's
+        bounding box are tested.
+        """
+        cells = np.zeros(self.nrows * self.ncols, dtype = bool)
+        if geom.is_empty:
+            return cells
+
+        # Row and column window covering the bounds.
+        xmin, ymin, xmax, ymax = geom.bounds
+        col0 = max(int(np.floor((xmin + 180.) / self.resolution)), 0)
+        col1 = min(int(np.ceil((xmax + 180.) / self.resolution)), self.ncols)
+        row0 = max(int(np.floor((ymin + 90.) / self.resolution)), 0)
+        row1 = min(int(np.ceil((ymax + 90.) / self.resolution)), self.nrows)
+
+        # Test all cell centers in the window at once.
+        cols, rows = np.meshgrid(np.arange(col0, col1), np.arange(row0, row1))
+        x = -180. + (cols + 0.5) * self.resolution
+        y = -90. + (rows + 0.5) * self.resolution
+        shapely.prepare(geom)
+        inside = shapely.contains_xy(geom, x, y)
+        cells[(rows * self.ncols + cols)[inside]] = True
+
+        # Set every cell the boundary touches.  Points spaced res/2 along
+        # it fall in or next to each such cell, so test the boxes of
+        # those cells and their neighbors against the range.
+        if self.all_touched:
+            edge = shapely.segmentize(geom.boundary, self.resolution / 2)
+            coords = shapely.get_coordinates(edge)
+            cols = np.floor((coords[:, 0] + 180.) / self.resolution).astype(np.int64)
+            rows = np.floor((coords[:, 1] + 90.) / self.resolution).astype(np.int64)
+            near = np.arange(-1, 2)
+            cols = np.clip((cols[:, None, None] + near[None, None, :]).repeat(3, axis = 1), 0, self.ncols - 1)
+            rows = np.clip((rows[:, None, None] + near[None, :, None]).repeat(3, axis = 2), 0, self.nrows - 1)
+            flat = np.unique(rows * self.ncols + cols)
+            rows, cols = np.divmod(flat, self.ncols)
+            boxes = shapely.box(
+                -180. + cols * self.resolution, -90. + rows * self.resolution,
+                -180. + (cols + 1) * self.resolution, -90. + (rows + 1) * self.resolution,
+            )
+            cells[flat[shapely.intersects(geom, boxes)]] = True
+        return cells
+
+
+    @property
+    def counts(self):
+        """
+        Square matrix of the number of cells shared by each pair of
+        species, with each species' own cell count on the diagonal.
+        Computed once, over only the bytes set in some range, by
+        unpacking chunks of bits and multiplying them as matrices.
+        """
+        if self._counts is None:
+            active = self.bits[:, self.bits.any(axis = 0)]
+            counts = np.zeros((len(self.names), len(self.names)), dtype = np.int64)
+            for start in range(0, active.shape[1], 4096):
+                chunk = np.unpackbits(active[:, start:start + 4096], axis = 1)
+                chunk = chunk.astype(np.float32)
+                counts += np.rint(chunk @ chunk.T).astype(np.int64)
+            self._counts = counts
+        return self._counts
+
+
+    def overlap(self):
+        """
+        Returns a dataframe of approximate overlap: the fraction of the
+        row species' cells that are also in the column species' range.
+        """
+        counts = self.counts
+        diag = np.diag(counts).astype(float)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            fraction = np.where(diag[:, None] > 0, counts / diag[:, None], 0.)
+        return pd.DataFrame(fraction, index = self.names, columns = self.names)
+
+
+    def candidates(self, min_cells = 1):
+        """
+        Returns (i, j) index pairs, i < j, of species sharing at least
+        `min_cells` cells.  Without all_touched, ranges overlapping by
+        less than about one cell can be missed.
+        """
+        idx, jdx = np.nonzero(np.triu(self.counts >= min_cells, k = 1))
+        return list(zip(idx.tolist(), jdx.tolist()))
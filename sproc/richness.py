@@ -0,0 +1,215 @@
+#!/usr/env/bin python
+
+"""
+Species richness: the number of ranges covering each cell of a global
+grid.
+"""
+
+import os
+import numpy as np
+import shapely
+from loguru import logger
+from sproc.helpers import write_json
+from sproc.overlap import load_levels, select_level
+
+
+# Latitude limit of web mercator maps.
+MERCATOR_LAT = 85.0511
+
+
+class RichnessGrid:
+    """
+    Stacks the geographic_range of sproc GeoJSON files on a global
+    lon/lat grid.  Each range is burned coarse blocks first: blocks
+    inside the range are filled whole, blocks outside are skipped, and
+    only the cells of blocks crossing its boundary get an exact area of
+    coverage.  The cells of each species are kept so one species can be
+    replaced without rebuilding the grid.
+
+    Parameters
+    ----------
+    json_files: list
+        sproc GeoJSON files.
+    resolution: float
+        Cell width in degrees.
+    min_cover: float
+        Fraction of a cell's area a range must cover to count in it;
+        0 counts every cell a range touches.
+    block: int
+        Width in cells of the coarse blocks.
+    accuracy: float
+        Burn the coarsest simplified range within this tolerance;
+        defaults to a quarter cell.  None burns the exact range.
+    """
+    def __init__(self, json_files, resolution = 0.25, min_cover = 0.5, block = 16, accuracy = "auto"):
+        self.resolution = resolution
+        self.min_cover = min_cover
+        self.block = block
+        self.accuracy = resolution / 4. if accuracy == "auto" else accuracy
+        self.nrows = int(np.ceil(180. / resolution))
+        self.ncols = int(np.ceil(360. / resolution))
+
+        # Cell counts, and the cells of each species.
+        self.counts = np.zeros(self.nrows * self.ncols, dtype = np.int32)
+        self.cells = {}
+
+        # Burn each range.
+        for json_file in json_files:
+            self.update(json_file)
+        logger.info(f"stacked {len(self.cells)} ranges at {resolution} degrees")
+
+
+    def burn(self, geom):
+        """
+        Returns the flat indices of cells covered by geom, with rows
+        counted from -90 and columns from -180.
+        """
+        if geom.is_empty:
+            return np.zeros(0, dtype = np.int64)
+        res = self.resolution
+        shapely.prepare(geom)
+
+        # Blocks covering the bounds, as their first cell and width.
+        width = self.block
+        xmin, ymin, xmax, ymax = geom.bounds
+        cols, rows = np.meshgrid(
+            np.arange(max(int(np.floor((xmin + 180.) / res)) // width, 0), int(np.ceil((xmax + 180.) / res / width))) * width,
+            np.arange(max(int(np.floor((ymin + 90.) / res)) // width, 0), int(np.ceil((ymax + 90.) / res / width))) * width,
+        )
+        cols, rows = cols.ravel(), rows.ravel()
+        pieces = np.full(len(cols), geom, dtype = object)
+        cells = []
+        while len(cols):
+            boxes = shapely.box(
+                -180. + cols * res, -90. + rows * res,
+                np.minimum(-180. + (cols + width) * res, 180.), np.minimum(-90. + (rows + width) * res, 90.),
+            )
+
+            # Fill blocks inside the range, and keep those crossing its boundary.
+            full = shapely.contains(geom, boxes)
+            part = ~full & shapely.intersects(geom, boxes)
+            offset = np.arange(width)
+            rfull = (rows[full, None, None] + offset[None, :, None]).astype(np.int64)
+            cfull = cols[full, None, None] + offset[None, None, :]
+            rfull, cfull = np.broadcast_arrays(rfull, cfull)
+            keep = (rfull < self.nrows) & (cfull < self.ncols)
+            cells.append(rfull[keep] * self.ncols + cfull[keep])
+
+            # Exact cover of boundary cells, from the range clipped to
+            # their parent block.
+            if width == 1:
+                cover = shapely.area(shapely.intersection(pieces[part], boxes[part])) / res ** 2
+                keep = cover >= self.min_cover if self.min_cover > 0 else cover > 0
+                cells.append(rows[part][keep].astype(np.int64) * self.ncols + cols[part][keep])
+                break
+
+            # Split boundary blocks into smaller blocks.
+            pieces = shapely.intersection(pieces[part], boxes[part])
+            step = width // 4 if width % 4 == 0 else 1
+            offset = np.arange(0, width, step)
+            rows = (rows[part, None, None] + offset[None, :, None]).repeat(len(offset), axis = 2)
+            cols = (cols[part, None, None] + offset[None, None, :]).repeat(len(offset), axis = 1)
+            pieces = np.broadcast_to(pieces[:, None, None], rows.shape)
+            keep = (rows < self.nrows) & (cols < self.ncols)
+            rows, cols, pieces = rows[keep], cols[keep], pieces[keep]
+            width = step
+        return np.concatenate(cells)
+
+
+    def update(self, json_file):
+        """
+        Add the range of a sproc GeoJSON file, replacing the species'
+        current range if it was added before.
+        """
+        name = os.path.basename(json_file).rsplit(".json")[0]
+        cells = self.burn(select_level(load_levels(json_file), self.accuracy)[1])
+        self.remove(name)
+        self.counts[cells] += 1
+        self.cells[name] = cells
+
+
+    def remove(self, name):
+        """
+        Take a species' range off the grid.
+        """
+        cells = self.cells.pop(name, None)
+        if cells is not None:
+            self.counts[cells] -= 1
+
+
+    @property
+    def richness(self):
+        """
+        2-D array of the number of ranges in each cell, with row 0 at
+        the north edge.
+        """
+        return self.counts.reshape(self.nrows, self.ncols)[::-1]
+
+
+    @property
+    def bounds(self):
+        """
+        (west, south, east, north) of the grid.
+        """
+        return (-180., -90., -180. + self.ncols * self.resolution, -90. + self.nrows * self.resolution)
+
+
+    def save(self, path):
+        """
+        Write the richness as a .npy raster with a sidecar .json of its
+        bounds, which sample.Raster reads.
+        """
+        np.save(path, self.richness)
+        write_json(path + ".json", {"bounds": list(self.bounds)})
+        logger.info(f"wrote {path}")
+
+
+    def _rgba(self, cmap):
+        """
+        Richness colored by a matplotlib colormap, with empty cells
+        transparent.
+        """
+        import matplotlib
+        richness = self.richness
+        rgba = matplotlib.colormaps[cmap](richness / max(richness.max(), 1))
+        rgba[richness == 0, 3] = 0.
+        return rgba
+
+
+    def plot(self, ax = None, cmap = "viridis", figsize = (12, 6)):
+        """
+        Plot richness on a matplotlib axis.  Returns the axis.
+        """
+        import matplotlib.pyplot as plt
+        if ax is None:
+            _, ax = plt.subplots(figsize = figsize)
+        west, south, east, north = self.bounds
+        image = ax.imshow(
+            np.ma.masked_equal(self.richness, 0), cmap = cmap, extent = (west, east, south, north),
+            interpolation = "nearest",
+        )
+        plt.colorbar(image, ax = ax, label = "species")
+        ax.set_xlabel("longitude")
+        ax.set_ylabel("latitude")
+        return ax
+
+
+    def layer(self, name = "richness", cmap = "viridis", opacity = 0.7):
+        """
+        Returns a folium image layer of richness, e.g. to add to
+        IMap(...).imap.
+        """
+        import folium
+
+        # Web maps stop short of the poles.
+        west, south, east, north = self.bounds
+        lats = north - (np.arange(self.nrows) + 0.5) * self.resolution
+        rows = np.abs(lats) <= MERCATOR_LAT
+        rgba = self._rgba(cmap)[rows]
+        return folium.raster_layers.ImageOverlay(
+            rgba,
+            bounds = [[lats[rows][-1] - self.resolution / 2, west], [lats[rows][0] + self.resolution / 2, east]],
+            name = name,
+            opacity = opacity,
+            mercator_project = True,
+        )
@@ -0,0 +1,241 @@
+#!/usr/env/bin python
+
+"""
+Sample environmental rasters (elevation, climate) at occurrence points.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sproc.cache import content_key
+from sproc.helpers import write_json
+
+
+# Default location of cached samples.
+SAMPLE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sproc", "samples")
+
+# Block shape used to order reads from .npy rasters.
+NPY_BLOCK = (256, 256)
+
+
+class Raster:
+    """
+    A single-band raster in lon/lat (EPSG:4326).  GeoTIFFs are read by
+    block through rasterio (optional dependency).  NumPy rasters are
+    2-D .npy arrays, memory-mapped, with row 0 at the north edge; their
+    extent is given by `bounds` or a sidecar <path>.json file holding
+    {"bounds": [west, south, east, north]}.
+
+    Parameters
+    ----------
+    path: str
+        A .tif or .npy raster file.
+    bounds: tuple
+        (west, south, east, north) of a .npy raster.
+    band: int
+        Band number (from 1) of a GeoTIFF.
+    """
+    def __init__(self, path, bounds = None, band = 1):
+        self.path = path
+        self.band = band
+        self.array = None
+        self.nodata = None
+
+        # Run internal functions.
+        if path.endswith(".npy"):
+            self._open_npy(bounds)
+        else:
+            self._open_tif()
+
+
+    def _open_npy(self, bounds):
+        """
+        Memory-map a .npy raster and get its extent.
+        """
+        self.array = np.load(self.path, mmap_mode = "r")
+        if bounds is None:
+            with open(self.path + ".json", 'r') as inf:
+                bounds = json.load(inf)["bounds"]
+        west, south, east, north = bounds
+        self.shape = self.array.shape
+        self.block_shape = NPY_BLOCK
+        xres = (east - west) / self.shape[1]
+        yres = (north - south) / self.shape[0]
+
+        # Coefficients mapping lon/lat to (col, row).
+        self.inverse = (1. / xres, 0., -west / xres, 0., -1. / yres, north / yres)
+
+
+    def _open_tif(self):
+        """
+        Read the grid, block layout and nodata value of a GeoTIFF.
+        """
+        try:
+            import rasterio
+        except ImportError:
+            raise ImportError("GeoTIFF sampling needs rasterio: pip install rasterio")
+        with rasterio.open(self.path) as src:
+            self.shape = src.shape
+            self.block_shape = src.block_shapes[self.band - 1]
+            self.nodata = src.nodata
+            inv = ~src.transform
+            self.inverse = (inv.a, inv.b, inv.c, inv.d, inv.e, inv.f)
+
+
+    @property
+    def version(self):
+        """
+        Identifies the raster file contents for caching.
+        """
+        stat = os.stat(self.path)
+        return f"{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}:{self.band}"
+
+
+    def cells(self, lons, lats):
+        """
+        Returns (rows, cols, inside) for lon/lat arrays, where inside
+        marks points on the raster.
+        """
+        a, b, c, d, e, f = self.inverse
+        cols = np.floor(a * lons + b * lats + c).astype(np.int64)
+        rows = np.floor(d * lons + e * lats + f).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        return rows, cols, inside
+
+
+    def sample(self, lons, lats):
+        """
+        Returns raster values at lon/lat arrays as floats, NaN off the
+        raster or at nodata.  Points are sorted by raster block and
+        each block is read once, in file order.
+        """
+        lons = np.asarray(lons, dtype = float)
+        lats = np.asarray(lats, dtype = float)
+        values = np.full(len(lons), np.nan)
+        rows, cols, inside = self.cells(lons, lats)
+        idx = np.flatnonzero(inside)
+        rows, cols = rows[idx], cols[idx]
+
+        # Sort points by block, then by cell within the block.
+        bh, bw = self.block_shape
+        nbcols = -(-self.shape[1] // bw)
+        blocks = (rows // bh) * nbcols + cols // bw
+        order = np.lexsort((cols, rows, blocks))
+        idx, rows, cols, blocks = idx[order], rows[order], cols[order], blocks[order]
+
+        # Memory-mapped arrays are read in that order by fancy indexing.
+        if self.array is not None:
+            values[idx] = self.array[rows, cols]
+
+        # GeoTIFFs are read one block window at a time.
+        else:
+            import rasterio
+            from rasterio.windows import Window
+            cuts = np.flatnonzero(blocks[1:] != blocks[:-1]) + 1
+            with rasterio.open(self.path) as src:
+                for part in np.split(np.arange(len(idx)), cuts):
+                    if not len(part):
+                        continue
+                    row0 = rows[part[0]] // bh * bh
+                    col0 = cols[part[0]] // bw * bw
+                    window = Window(
+                        col0, row0,
+                        min(bw, self.shape[1] - col0),
+                        min(bh, self.shape[0] - row0),
+                    )
+                    block = src.read(self.band, window = window)
+                    values[idx[part]] = block[rows[part] - row0, cols[part] - col0]
+
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        return values
+
+
+def sample(raster, lons, lats, cache = SAMPLE_DIR):
+    """
+    Sample a Raster (or raster file) at lon/lat arrays.  Results are
+    cached by point coordinates and raster version unless cache is
+    None.
+    """
+    if not isinstance(raster, Raster):
+        raster = Raster(raster)
+    lons = np.asarray(lons, dtype = float)
+    lats = np.asarray(lats, dtype = float)
+
+    # Look for a cached result.
+    entry = None
+    if cache:
+        os.makedirs(cache, exist_ok = True)
+        key = content_key([lons, lats], {"raster": raster.version})
+        entry = os.path.join(cache, key + ".npy")
+        if os.path.exists(entry):
+            return np.load(entry)
+
+    # Sample and cache, writing to a temporary file first.
+    values = raster.sample(lons, lats)
+    if entry:
+        tmpfile = f"{entry}.{os.getpid()}.tmp"
+        with open(tmpfile, 'wb') as outf:
+            np.save(outf, values)
+        os.replace(tmpfile, entry)
+    return values
+
+
+def sample_ranges(json_files, rasters, cache = SAMPLE_DIR):
+    """
+    Sample rasters at the occurrences of many range files and store
+    the values as properties of each occurrence feature.  Points of
+    all files are sampled together so each raster is read once.
+
+    Parameters
+    ----------
+    json_files: list
+        sproc GeoJSON range files, updated in place.
+    rasters: dict
+        Property name to Raster or raster file, e.g. {"elevation":
+        "srtm.tif"}.
+    cache: str
+        Directory of cached samples, or None.
+
+    Returns a dataframe with one row per occurrence: file, lon, lat
+    and a column for each raster.
+    """
+
+    # Collect the occurrence coordinates of every file.
+    collections = []
+    coords = []
+    for json_file in json_files:
+        with open(json_file, 'r') as inf:
+            collection = json.load(inf)
+        features = [
+            i for i in collection['features']
+            if i['properties'].get('type') == "occurrence"
+        ]
+        collections.append((json_file, collection, features))
+        coords.append(np.array(
+            [i['geometry']['coordinates'] for i in features], dtype = float).reshape(-1, 2))
+    coords = np.vstack(coords) if coords else np.zeros((0, 2))
+
+    # Sample every raster at all points.
+    table = pd.DataFrame({
+        "file": np.repeat(
+            [i[0] for i in collections], [len(i[2]) for i in collections]),
+        "lon": coords[:, 0],
+        "lat": coords[:, 1],
+    })
+    for name, raster in rasters.items():
+        table[name] = sample(raster, coords[:, 0], coords[:, 1], cache = cache)
+        logger.info(f"sampled {name} at {len(table)} points")
+
+    # Store values with the points and rewrite each file.
+    start = 0
+    for json_file, collection, features in collections:
+        values = table.iloc[start:start + len(features)]
+        for name in rasters:
+            for feature, value in zip(features, values[name]):
+                feature['properties'][name] = None if np.isnan(value) else float(value)
+        write_json(json_file, collection, indent = 4)
+        start += len(features)
+    return table
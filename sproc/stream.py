@@ -0,0 +1,111 @@
+#!/usr/env/bin python
+
+"""
+Overlap fetching pages of records with range geometry work.
+"""
+
+import queue
+import threading
+import numpy as np
+import pandas as pd
+import shapely
+from loguru import logger
+from sproc.globals import LAND
+
+
+class StreamingRange:
+    """
+    Consumes pages of occurrence records as they are fetched.  Records
+    are buffered and a running convex hull of all points is kept, along
+    with the LAND polygons that hull touches.  The range built from
+    non-outlier points lies inside the hull of all points, so once the
+    last page lands the final clip only needs those land polygons.
+
+    Parameters
+    ----------
+    land: shapely MultiPolygon
+        Land cover that ranges are clipped to.
+    """
+    def __init__(self, land = LAND):
+        self.land = land
+        self.parts = np.array(land.geoms)
+        self.tree = shapely.STRtree(self.parts)
+        self.pages = []
+        self.hull = None
+        self.touched = np.zeros(len(self.parts), dtype = bool)
+
+
+    def add(self, page):
+        """
+        Buffer a page of records and grow the running hull.
+        """
+        if page.empty:
+            return
+        self.pages.append(page)
+
+        # Hull of the previous hull and the new points.
+        coords = page[["decimalLongitude", "decimalLatitude"]].to_numpy(dtype = float)
+        if self.hull is not None:
+            coords = np.vstack([shapely.get_coordinates(self.hull), coords])
+        hull = shapely.multipoints(coords).convex_hull
+
+        # Find land polygons touched by the area the hull grew into.
+        grown = hull if self.hull is None else hull.difference(self.hull)
+        if not grown.is_empty:
+            self.touched[self.tree.query(grown, predicate = "intersects")] = True
+        self.hull = hull
+
+
+    @property
+    def land_subset(self):
+        """
+        MultiPolygon of the land polygons touched by the running hull.
+        """
+        return shapely.geometry.MultiPolygon(list(self.parts[self.touched]))
+
+
+    @property
+    def data(self):
+        """
+        All buffered records as one dataframe, without repeated keys.
+        """
+        data = pd.concat(self.pages, ignore_index = True)
+        return data.drop_duplicates(subset = "key").reset_index(drop = True)
+
+
+def stream_pages(records, consumer, maxsize = 16):
+    """
+    Fetch pages from a lazy fetch.Fetch in a background thread while
+    the calling thread passes each one to consumer.add().  Network
+    waits and geometry work (which releases the GIL in GEOS) overlap.
+    """
+    pages = queue.Queue(maxsize = maxsize)
+    done = object()
+    errors = []
+
+    # Producer puts pages on the queue, then a sentinel.
+    def produce():
+        try:
+            for page in records.iter_pages():
+                pages.put(page)
+        except Exception as err:
+            errors.append(err)
+        finally:
+            pages.put(done)
+
+    thread = threading.Thread(target = produce, daemon = True)
+    thread.start()
+
+    # Consume pages until the sentinel arrives.
+    npages = 0
+    while 1:
+        page = pages.get()
+        if page is done:
+            break
+        consumer.add(page)
+        npages += 1
+    thread.join()
+    if errors:
+        raise errors[0]
+    logger.info(f"streamed {npages} pages")
+    return consumer
@@ -0,0 +1,158 @@
+#!/usr/env/bin python
+
+"""
+Sweep the outlier scalar of a species' range in one pass.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+from loguru import logger
+from sproc.globals import LAND
+from sproc.jsonify import EXCLUDE_COLUMNS
+from sproc.landclip import land_index, clip_to_land
+from sproc.outliers import median_scores, median_threshold, knn_scores, knn_threshold, mark_outliers
+from sproc.quantize import PRECISION, quantize_coords, dequantize
+
+
+def median_masks(lons, lats, scalars, **kwargs):
+    """
+    Outlier masks of the median rule for each scalar, one row per
+    scalar, from one set of distances.
+    """
+    return median_threshold(median_scores(lons, lats), scalars)
+
+
+def knn_masks(lons, lats, scalars, k = 10, **kwargs):
+    """
+    Outlier masks of the knn rule for each scalar, one row per scalar,
+    from one set of k-th neighbor distances.
+    """
+    if len(lons) <= k:
+        return np.zeros((len(scalars), len(lons)), dtype = bool)
+    return knn_threshold(knn_scores(lons, lats, k), scalars)
+
+
+# Rules whose masks for all scalars come from one set of distances.
+SWEEPS = {
+    "median": median_masks,
+    "knn": knn_masks,
+}
+
+
+class OutlierSweep:
+    """
+    Builds a species' range for many outlier scalars at once, as
+    GeographicRange would for each.  Distances are computed once and
+    thresholded for every scalar; hulls are built only for distinct
+    outlier sets, and clipped to land only once per distinct hull.
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        Occurrence records, as passed to GeographicRange.
+    scalars: list
+        Outlier scalars to evaluate.
+    outlier_method: str
+        Outlier rule from sproc.outliers.  Rules not in SWEEPS (e.g.
+        'dbscan') are run once per scalar.
+    land: MultiPolygon
+        Land to clip ranges to.
+    precision: int
+        Decimal places coordinates are held at.
+    **kwargs:
+        Other outlier rule parameters, e.g. k.
+    """
+    def __init__(
+        self,
+        data,
+        scalars = (1.5, 2, 2.5, 3, 3.5, 4),
+        outlier_method = "median",
+        land = None,
+        precision = PRECISION,
+        **kwargs,
+        ):
+        self.data = data.reset_index(drop = True)
+        self.scalars = np.asarray(scalars, dtype = float)
+        self.method = outlier_method
+        self.land = LAND if land is None else land
+        self.coords = dequantize(quantize_coords(self.data, precision), precision)
+
+        # Placeholders for results.
+        self.masks = None
+        self.ranges = None
+        self.table = None
+
+        # Run internal functions.
+        self._mark_outliers(**kwargs)
+        self._build()
+
+
+    def _mark_outliers(self, **kwargs):
+        """
+        Outlier masks of every scalar, one row per scalar.  Records
+        already excluded are outliers and are not scored.
+        """
+        keep = np.ones(len(self.data), dtype = bool)
+        for column in EXCLUDE_COLUMNS:
+            if column in self.data.columns:
+                keep &= ~self.data[column].to_numpy(dtype = bool)
+        lons, lats = self.coords[keep].T
+
+        # Threshold one set of distances, or run the rule per scalar.
+        if self.method in SWEEPS:
+            scored = SWEEPS[self.method](lons, lats, self.scalars, **kwargs)
+        else:
+            scored = np.array([
+                mark_outliers(lons, lats, method = self.method, scalar = scalar, **kwargs)[1]
+                for scalar in self.scalars
+            ], dtype = bool).reshape(len(self.scalars), keep.sum())
+        self.masks = np.ones((len(self.scalars), len(self.data)), dtype = bool)
+        self.masks[:, keep] = scored
+
+
+    def _build(self):
+        """
+        Build and clip the hulls of the distinct outlier sets.
+        """
+        masks, inverse = np.unique(self.masks, axis = 0, return_inverse = True)
+        inverse = inverse.ravel()
+
+        # Hulls of every distinct set of kept points at once.
+        rows, points = np.nonzero(~masks)
+        hulls = shapely.convex_hull(shapely.multipoints(
+            self.coords[points],
+            indices = rows,
+            out = np.array([shapely.MultiPoint()] * len(masks), dtype = object),
+        ))
+
+        # Different outlier sets often share a hull; clip each hull once.
+        _, first, hull_of = np.unique(
+            shapely.to_wkb(shapely.normalize(hulls)),
+            return_index = True,
+            return_inverse = True,
+        )
+        hull_of = hull_of.ravel()
+        clipped = clip_to_land(hulls[first], *land_index(self.land))
+        self.ranges = clipped[hull_of[inverse]]
+
+        self.table = pd.DataFrame({
+            "scalar": self.scalars,
+            "outliers": self.masks.sum(axis = 1),
+            "kept": (~self.masks).sum(axis = 1),
+            "hull_area": shapely.area(hulls[inverse]),
+            "land_area": shapely.area(self.ranges),
+        })
+        logger.info(
+            f"swept {len(self.scalars)} scalars: {len(masks)} outlier sets, {len(first)} hulls"
+        )
+
+
+    def range(self, scalar):
+        """
+        The land-clipped range at one of the swept scalars.
+        """
+        idx = np.nonzero(np.isclose(self.scalars, scalar))[0]
+        if not len(idx):
+            raise ValueError(f"scalar {scalar} was not swept")
+        return self.ranges[idx[0]]
@@ -0,0 +1,107 @@
+#!/usr/env/bin python
+
+"""
+Spatial thinning of occurrence records before range building.
+"""
+
+import numpy as np
+from loguru import logger
+
+
+def grid_cells(lons, lats, resolution = 0.1):
+    """
+    Returns an integer cell id for each point on a regular lon/lat grid
+    with cells `resolution` degrees wide.
+    """
+    ncols = int(np.ceil(360. / resolution)) + 1
+    col = np.floor((np.asarray(lons) + 180.) / resolution).astype(np.int64)
+    row = np.floor((np.asarray(lats) + 90.) / resolution).astype(np.int64)
+    return row * ncols + col
+
+
+def geohash_cells(lons, lats, precision = 5):
+    """
+    Returns the geohash of each point as an integer, which orders and
+    buckets points the same as the usual base32 string of `precision`
+    characters.  Bits of longitude and latitude are interleaved,
+    starting with longitude.
+    """
+    nbits = 5 * precision
+    lonbits = (nbits + 1) // 2
+    latbits = nbits // 2
+
+    # Quantize each axis onto its number of bits.
+    qlon = np.floor((np.asarray(lons) + 180.) / 360. * 2 ** lonbits).astype(np.int64)
+    qlat = np.floor((np.asarray(lats) + 90.) / 180. * 2 ** latbits).astype(np.int64)
+    qlon = np.clip(qlon, 0, 2 ** lonbits - 1)
+    qlat = np.clip(qlat, 0, 2 ** latbits - 1)
+
+    # Interleave bits from most to least significant.
+    cells = np.zeros(qlon.shape, dtype = np.int64)
+    for bit in range(nbits):
+        if bit % 2 == 0:
+            value = (qlon >> (lonbits - 1 - bit // 2)) & 1
+        else:
+            value = (qlat >> (latbits - 1 - bit // 2)) & 1
+        cells = (cells << 1) | value
+    return cells
+
+
+def thin(data, resolution = 0.1, method = "grid", by = None):
+    """
+    Keep one representative record per spatial cell.  The record kept
+    is the one closest to the mean of the cell's points, and a `count`
+    column stores how many records fell in the cell.  Records already
+    carrying a `count` (i.e. thinned before) are weighted by it.
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        Occurrence records with decimalLongitude/decimalLatitude.
+    resolution: float or int
+        Cell width in degrees for method 'grid', or the number of
+        geohash characters for method 'geohash'.
+    method: str
+        'grid' or 'geohash'.
+    by: list
+        Columns whose groups are thinned separately, e.g. the
+        'flagged' and 'introduced' marks, so that a cell's
+        representative never stands for records of another group.
+    """
+    lons = data.decimalLongitude.to_numpy(dtype = float)
+    lats = data.decimalLatitude.to_numpy(dtype = float)
+    if method == "grid":
+        cells = grid_cells(lons, lats, resolution)
+    elif method == "geohash":
+        cells = geohash_cells(lons, lats, int(resolution))
+    else:
+        raise ValueError(f"unknown thinning method: {method}")
+
+    # Index each point by its cell, within its group.
+    if by:
+        groups = data.groupby(list(by), sort = False, dropna = False).ngroup().to_numpy()
+        _, inverse = np.unique(np.column_stack([cells, groups]), axis = 0, return_inverse = True)
+        inverse = inverse.ravel()
+    else:
+        _, inverse = np.unique(cells, return_inverse = True)
+    weights = (
+        data["count"].to_numpy() if "count" in data.columns
+        else np.ones(len(data), dtype = np.int64)
+    )
+    counts = np.bincount(inverse, weights = weights)
+
+    # Distance from each point to the weighted mean of its cell.
+    mlon = np.bincount(inverse, weights = lons * weights) / counts
+    mlat = np.bincount(inverse, weights = lats * weights) / counts
+    dist = (lons - mlon[inverse]) ** 2 + (lats - mlat[inverse]) ** 2
+
+    # Take the closest point in each cell, keeping original order.
+    order = np.lexsort((dist, inverse))
+    first = np.ones(len(order), dtype = bool)
+    first[1:] = inverse[order][1:] != inverse[order][:-1]
+    keep = np.sort(order[first])
+
+    thinned = data.iloc[keep].reset_index(drop = True)
+    thinned["count"] = counts[inverse[keep]].astype(np.int64)
+    logger.info(f"thinned {len(data)} records to {len(thinned)} cells")
+    return thinned
@@ -0,0 +1,278 @@
+#!/usr/env/bin python
+
+"""
+Tiled map data, loaded by the map as the viewport moves.
+
+Each species' range and occurrences are written once per zoom level:
+
+    tiledir/<name>/<level>/range.js   range simplified for the level
+    tiledir/<name>/<level>/<x>_<y>.js occurrences in one lon/lat tile
+
+Coarse levels hold occurrences thinned to one per grid cell, so a
+world view loads a few small files, and the full records are only
+loaded for the tiles in view once zoomed in.  Tiles are <script>
+includes calling sproc_tile(), since browsers block requests for
+local files from pages opened with file://.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import shapely.geometry
+from branca.element import MacroElement, Template
+from sproc.overlap import _levels, select_level
+from sproc.thin import thin
+
+
+# Data levels as (first map zoom, tile width in degrees, thinning cell
+# width in degrees or None for all records, range accuracy in degrees
+# or None for the map accuracy).
+LEVELS = (
+    (0, 360., 1., 0.1),
+    (4, 30., 0.1, 0.05),
+    (7, 5., None, None),
+)
+
+# CSS for marker color names that are not CSS colors.
+CSS_COLORS = {"darkpurple": "#5b396b", "lightred": "#ff8e7f"}
+
+
+def tile_index(lons, lats, size):
+    """
+    Returns the column and row of each point's tile on a grid of tiles
+    `size` degrees wide, counted from -180/-90.
+    """
+    ncols = max(int(np.ceil(360. / size)), 1)
+    nrows = max(int(np.ceil(180. / size)), 1)
+    col = np.clip(np.floor((np.asarray(lons) + 180.) / size).astype(np.int64), 0, ncols - 1)
+    row = np.clip(np.floor((np.asarray(lats) + 90.) / size).astype(np.int64), 0, nrows - 1)
+    return col, row
+
+
+def _occurrences(collection):
+    """
+    Returns a dataframe of the occurrence points of a loaded feature
+    collection, with record text and a boolean outlier column.
+    """
+    rows = [
+        (
+            *feature['geometry']['coordinates'][:2],
+            feature['properties'].get('record'),
+            feature['properties'].get('outlier') == "true",
+        )
+        for feature in collection['features']
+        if feature['properties'].get('type') == "occurrence"
+    ]
+    return pd.DataFrame(rows, columns = ["decimalLongitude", "decimalLatitude", "record", "outlier"])
+
+
+def _write_tile(path, name, level, key, data):
+    """
+    Write one tile as a sproc_tile() call.
+    """
+    with open(path + ".tmp", 'w') as outf:
+        args = ", ".join(json.dumps(i, separators = (",", ":")) for i in (name, level, key, data))
+        outf.write(f"sproc_tile({args});\n")
+    os.replace(path + ".tmp", path)
+
+
+def write_tiles(json_file, tiledir, accuracy = 0.01, levels = LEVELS):
+    """
+    Write the tiles of one range file.  Returns its index entry: the
+    lon/lat bounds, and for each level the first map zoom, tile width
+    and the keys of its non-empty tiles.
+
+    Parameters
+    ----------
+    json_file: str
+        sproc GeoJSON range file.
+    tiledir: str
+        Directory that tiles are written under.
+    accuracy: float
+        Range accuracy at the finest level; None draws the exact range.
+    levels: tuple
+        Data levels, as in LEVELS.
+    """
+    name = os.path.basename(json_file).rsplit(".json")[0]
+    with open(json_file, 'r') as inf:
+        collection = json.load(inf)
+    ranges = _levels(collection, json_file)
+    points = _occurrences(collection)
+
+    index = {"bounds": ranges[0.].bounds, "levels": []}
+    for level, (zoom, size, resolution, range_accuracy) in enumerate(levels):
+        outdir = os.path.join(tiledir, name, str(level))
+        os.makedirs(outdir, exist_ok = True)
+
+        # The range, no finer than the map accuracy.
+        if range_accuracy is None:
+            range_accuracy = accuracy
+        elif accuracy is not None:
+            range_accuracy = max(range_accuracy, accuracy)
+        _, geom = select_level(ranges, range_accuracy)
+        feature = {"type": "Feature", "properties": {}, "geometry": shapely.geometry.mapping(geom)}
+        _write_tile(os.path.join(outdir, "range.js"), name, level, "range", feature)
+
+        # Occurrences, thinned apart from outliers so neither hides the other.
+        if resolution is None or points.empty:
+            subset = points.assign(count = 1)
+        else:
+            subset = pd.concat([
+                thin(points[points.outlier == i], resolution)
+                for i in (False, True)
+                if (points.outlier == i).any()
+            ], ignore_index = True)
+
+        # Write the points of each tile.
+        keys = []
+        if not subset.empty:
+            col, row = tile_index(subset.decimalLongitude, subset.decimalLatitude, size)
+            subset = subset.assign(key = [f"{i}_{j}" for i, j in zip(col, row)])
+            for key, tile in subset.groupby("key", sort = True):
+                features = [
+                    {
+                        "type": "Feature",
+                        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                        "properties": {"record": record, "outlier": bool(outlier), "count": int(count)},
+                    }
+                    for lon, lat, record, outlier, count in zip(
+                        tile.decimalLongitude, tile.decimalLatitude, tile.record, tile.outlier, tile["count"]
+                    )
+                ]
+                data = {"type": "FeatureCollection", "features": features}
+                _write_tile(os.path.join(outdir, key + ".js"), name, level, key, data)
+                keys.append(key)
+        index["levels"].append({"zoom": zoom, "size": size, "tiles": keys})
+    return index
+
+
+class TileLayers(MacroElement):
+    """
+    Loads the tiles of every species in view at the current zoom into
+    its range, occurrences and outliers layers, and drops tiles that
+    leave the view.
+
+    Parameters
+    ----------
+    url: str
+        URL of the tile directory, relative to the saved map.
+    species: dict
+        Name to (index entry, color, (range, occurrences, outliers)
+        layer variable names).
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var url = {{ this.url|tojson }};
+            var index = {{ this.index|tojson }};
+            var colors = {{ this.colors|tojson }};
+            var groups = {
+                {% for name, layers in this.layers.items() %}
+                {{ name|tojson }}: [{{ layers|join(", ") }}],
+                {% endfor %}
+            };
+            var cache = {}, requested = {}, drawn = {};
+
+            function markers(name, outlier) {
+                return L.geoJson(null, {
+                    filter: function(feature) {
+                        return feature.properties.outlier === outlier;
+                    },
+                    pointToLayer: function(feature, latlng) {
+                        return L.circleMarker(latlng, {
+                            radius: 5, weight: 2, color: colors[name],
+                            fillColor: outlier ? "#ffffff" : colors[name], fillOpacity: 0.7
+                        });
+                    },
+                    onEachFeature: function(feature, layer) {
+                        var text = feature.properties.record || "";
+                        if (feature.properties.count > 1) {
+                            text += "<br>" + feature.properties.count + " records in cell";
+                        }
+                        if (text) {
+                            layer.bindPopup(text);
+                        }
+                    }
+                });
+            }
+
+            window.sproc_tile = function(name, level, key, data) {
+                var id = name + "/" + level + "/" + key;
+                if (key === "range") {
+                    cache[id] = [[0, L.geoJson(data)]];
+                } else {
+                    cache[id] = [
+                        [1, markers(name, false).addData(data)],
+                        [2, markers(name, true).addData(data)]
+                    ];
+                }
+                update();
+            };
+
+            function wanted() {
+                var zoom = map.getZoom(), bounds = map.getBounds(), ids = {};
+                for (var name in index) {
+                    var levels = index[name].levels, level = 0;
+                    while (level + 1 < levels.length && zoom >= levels[level + 1].zoom) {
+                        level++;
+                    }
+                    var size = levels[level].size, tiles = levels[level].tiles;
+                    var x0 = Math.floor((Math.max(bounds.getWest(), -180) + 180) / size);
+                    var x1 = Math.floor((Math.min(bounds.getEast(), 180) + 180) / size);
+                    var y0 = Math.floor((Math.max(bounds.getSouth(), -90) + 90) / size);
+                    var y1 = Math.floor((Math.min(bounds.getNorth(), 90) + 90) / size);
+                    ids[name + "/" + level + "/range"] = name;
+                    for (var i = 0; i < tiles.length; i++) {
+                        var xy = tiles[i].split("_");
+                        if (xy[0] >= x0 && xy[0] <= x1 && xy[1] >= y0 && xy[1] <= y1) {
+                            ids[name + "/" + level + "/" + tiles[i]] = name;
+                        }
+                    }
+                }
+                return ids;
+            }
+
+            function update() {
+                var ids = wanted();
+                for (var id in drawn) {
+                    if (!(id in ids)) {
+                        drawn[id].forEach(function(part) {
+                            groups[drawn[id].name][part[0]].removeLayer(part[1]);
+                        });
+                        delete drawn[id];
+                    }
+                }
+                for (var id in ids) {
+                    if (id in drawn) {
+                        continue;
+                    }
+                    if (id in cache) {
+                        drawn[id] = cache[id];
+                        drawn[id].name = ids[id];
+                        cache[id].forEach(function(part) {
+                            groups[ids[id]][part[0]].addLayer(part[1]);
+                        });
+                    } else if (!(id in requested)) {
+                        requested[id] = true;
+                        var script = document.createElement("script");
+                        script.src = url + "/" + id + ".js";
+                        document.body.appendChild(script);
+                    }
+                }
+            }
+
+            map.on("moveend", update);
+            update();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, species):
+        super().__init__()
+        self._name = "TileLayers"
+        self.url = url.rstrip("/")
+        self.index = {name: entry for name, (entry, _, _) in species.items()}
+        self.colors = {name: CSS_COLORS.get(color, color) for name, (_, color, _) in species.items()}
+        self.layers = {name: list(layers) for name, (_, _, layers) in species.items()}
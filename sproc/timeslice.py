@@ -0,0 +1,219 @@
+#!/usr/env/bin python
+
+"""
+Ranges per collection-year window, to follow range shifts over time.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import shapely
+import geojson
+from loguru import logger
+from sproc.globals import LAND
+from sproc.jsonify import range_feature
+from sproc.landclip import land_index, clip_to_land
+from sproc.outliers import mark_outliers
+
+
+def record_years(data):
+    """
+    Returns the collection year of each record as floats, taken from
+    the year column or else the start of eventDate (NaN if neither).
+    """
+    years = pd.Series(np.nan, index = data.index)
+    if "year" in data.columns:
+        years = pd.to_numeric(data.year, errors = "coerce")
+    if "eventDate" in data.columns:
+        dates = pd.to_numeric(data.eventDate.astype(str).str[:4], errors = "coerce")
+        years = years.fillna(dates)
+    return years.to_numpy(dtype = float)
+
+
+def grouped_median_outliers(lons, lats, groups, scalar = 3):
+    """
+    The outlier_median rule applied within each group in one pass:
+    distances are from the group's median lat/long and compared to
+    scalar times the std of the group's log distances.
+    """
+    frame = pd.DataFrame({"lon": lons, "lat": lats, "group": groups})
+    medians = frame.groupby("group")[["lon", "lat"]].transform("median")
+    distance = np.hypot(frame.lon - medians.lon, frame.lat - medians.lat) + 1e-7
+    logdist = np.log(distance)
+    std = logdist.groupby(frame.group).transform("std")
+    return distance.to_numpy(), (logdist >= std * scalar).to_numpy()
+
+
+class TimeSlicedRange:
+    """
+    Builds a range for each collection-year window of a species'
+    records.  Outliers are marked within each window and the hulls of
+    all windows are built and clipped to land together, sharing one
+    index of the land polygons.  Cumulative ranges (all records up to
+    the end of each window) are grown from the previous window's
+    cumulative hull.  All ranges are written to one GeoJSON file.
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        Occurrence records with year and/or eventDate columns.
+    name: str
+        Name used for the output file.
+    workdir: str
+        Output directory.
+    width: int
+        Window width in years.  Windows start at multiples of width,
+        e.g. decades for 10.
+    scalar: float
+        Outlier scalar.
+    outlier_method: str
+        Outlier rule from sproc.outliers.  The median rule is applied
+        to all windows at once, others window by window.
+    min_records: int
+        Windows with fewer non-outlier records get no range.
+    """
+    def __init__(
+        self,
+        data,
+        name = "test",
+        workdir = ".",
+        width = 10,
+        scalar = 3,
+        outlier_method = "median",
+        min_records = 3,
+        land = LAND,
+        ):
+        self.name = name
+        self.workdir = workdir
+        self.width = width
+        self.json_file = (
+            os.path.join(self.workdir, self.name + "_slices.json")
+            .replace(" ", "_")
+        )
+
+        # Land polygons and their index shared by all windows.
+        self.tree, self.parts = land_index(land)
+
+        # Assign records to windows, dropping those without a year.
+        years = record_years(data)
+        dated = ~np.isnan(years)
+        if (~dated).any():
+            logger.info(f"skipped {(~dated).sum()} records without a year")
+        self.data = data[dated].reset_index(drop = True)
+        self.data["window"] = (years[dated] // width * width).astype(int)
+
+        # Placeholders for per-window results.
+        self.slices = None
+
+        # Run internal functions.
+        self._mark_outliers(scalar, outlier_method)
+        self._build(min_records)
+        self.write()
+
+
+    def _mark_outliers(self, scalar, method):
+        """
+        Label outliers within each window.
+        """
+        lons = self.data.decimalLongitude.to_numpy(dtype = float)
+        lats = self.data.decimalLatitude.to_numpy(dtype = float)
+        windows = self.data.window.to_numpy()
+        if method == "median":
+            distance, mask = grouped_median_outliers(lons, lats, windows, scalar)
+        else:
+            distance = np.zeros(len(lons))
+            mask = np.zeros(len(lons), dtype = bool)
+            for window in np.unique(windows):
+                rows = windows == window
+                distance[rows], mask[rows] = mark_outliers(
+                    lons[rows], lats[rows], method = method, scalar = scalar)
+        self.data["outlier_distance"] = distance
+        self.data["outlier_status"] = mask
+        logger.info(f"dropped outliers: {mask.sum()}")
+
+
+    def _build(self, min_records):
+        """
+        Build the per-window and cumulative hulls and clip them to land.
+        """
+
+        # Record counts over every window, including windows whose
+        # records are all outliers.
+        windows = np.unique(self.data.window.to_numpy())
+        records = self.data.groupby("window").size().reindex(windows).to_numpy()
+
+        kept = self.data[~self.data.outlier_status]
+        coords = kept[["decimalLongitude", "decimalLatitude"]].to_numpy(dtype = float)
+        built, labels, counts = np.unique(
+            kept.window.to_numpy(), return_inverse = True, return_counts = True)
+
+        # Hulls of every window at once, from points sorted by window.
+        order = np.argsort(labels, kind = "stable")
+        coords, labels = coords[order], labels[order]
+        hulls = shapely.convex_hull(shapely.multipoints(coords, indices = labels))
+
+        # Each cumulative hull is the hull of the previous one and the new points.
+        cumulative = []
+        hull = None
+        for points in np.split(coords, np.cumsum(counts)[:-1]) if len(built) else []:
+            if hull is not None:
+                points = np.vstack([shapely.get_coordinates(hull), points])
+            hull = shapely.multipoints(points).convex_hull
+            cumulative.append(hull)
+        cumulative = np.array(cumulative, dtype = object)
+
+        # Clip both sets of hulls to land in one pass.
+        clipped = clip_to_land(np.concatenate([hulls, cumulative]), self.tree, self.parts)
+
+        # Attach ranges to the windows that have kept points; the
+        # cumulative range carries over windows without any.
+        rows = np.searchsorted(windows, built)
+        ranges = np.full(len(windows), None, dtype = object)
+        ranges[rows] = clipped[:len(built)]
+        kept_counts = np.zeros(len(windows), dtype = int)
+        kept_counts[rows] = counts
+
+        # Index of the last built window at or before each window; -1
+        # (before the first) picks the empty range appended at the end.
+        last = np.cumsum(kept_counts > 0) - 1
+        cumulative = np.append(clipped[len(built):], shapely.MultiPolygon())[last]
+
+        self.slices = pd.DataFrame({
+            "start": windows,
+            "end": windows + self.width - 1,
+            "records": records,
+            "total": records.cumsum(),
+            "kept": kept_counts,
+            "range": ranges,
+            "cumulative_range": cumulative,
+        })
+        self.slices.loc[self.slices.kept < min_records, "range"] = None
+        logger.info(f"built ranges for {len(built)} of {len(windows)} windows of {self.width} years")
+
+
+    def write(self):
+        """
+        Writes all window ranges to one GeoJSON file.
+        """
+        collection = geojson.FeatureCollection(
+            features = [],
+            properties = {"name": self.name, "width": self.width},
+        )
+        for row in self.slices.itertuples():
+            window = {"start": int(row.start), "end": int(row.end)}
+            if row.range is not None and not row.range.is_empty:
+                collection['features'].append(range_feature(
+                    row.range,
+                    {"type": "time_slice_range", "records": int(row.records), **window},
+                ))
+            if not row.cumulative_range.is_empty:
+                collection['features'].append(range_feature(
+                    row.cumulative_range,
+                    {"type": "cumulative_range", "records": int(row.total), **window},
+                ))
+
+        # If the provided workdir doesn't exist, make it.
+        os.makedirs(self.workdir, exist_ok = True)
+        with open(self.json_file, 'w') as outf:
+            outf.write(geojson.dumps(collection, indent = 4))
+        logger.info(f"wrote time slices to {self.json_file}")
@@ -0,0 +1,256 @@
+#!/usr/env/bin python
+
+"""
+A work queue of species on a shared directory, for batch runs across
+many processes or hosts without a broker.
+
+Each species is a small JSON file that moves between subdirectories
+of the queue directory:
+
+    todo/     waiting to be claimed
+    claimed/  being worked on; the file's mtime is the worker heartbeat
+    done/     finished, with per-stage status and timings
+    failed/   a stage raised an error
+
+Moves use os.rename, which is atomic on a POSIX filesystem (including
+NFS within one export), so exactly one worker wins each claim.  Claims
+whose heartbeat is older than `ttl` seconds are returned to todo/.
+"""
+
+import os
+import glob
+import json
+import time
+import socket
+import threading
+import pandas as pd
+from loguru import logger
+from sproc.helpers import write_json
+
+
+# Subdirectories of a queue, one per state.
+STATES = ("todo", "claimed", "done", "failed")
+
+
+class WorkQueue:
+    """
+    A species work queue in a shared directory.
+
+    Parameters
+    ----------
+    path: str
+        Queue directory, on a filesystem all workers can reach.
+    ttl: float
+        Seconds after the last heartbeat when a claim expires.
+    """
+    def __init__(self, path, ttl = 600.):
+        self.path = path
+        self.ttl = ttl
+        for state in STATES:
+            os.makedirs(os.path.join(self.path, state), exist_ok = True)
+
+
+    def _file(self, state, species):
+        """
+        Path of a species' file in a state directory.
+        """
+        return os.path.join(self.path, state, species.replace(" ", "_") + ".json")
+
+
+    def fill(self, species_list, force = False):
+        """
+        Add species that are not already queued, claimed or finished.
+        With force, finished and failed species are queued again.
+        Returns the number of species added.
+        """
+        added = 0
+        for species in species_list:
+            if force:
+                for state in ("done", "failed"):
+                    if os.path.exists(self._file(state, species)):
+                        os.remove(self._file(state, species))
+            if any(os.path.exists(self._file(i, species)) for i in STATES):
+                continue
+            write_json(self._file("todo", species), {"species": species, "queued": time.time()})
+            added += 1
+        logger.info(f"queued {added} species in {self.path}")
+        return added
+
+
+    def claim(self, worker):
+        """
+        Claim the next species in todo/ for worker.  Returns the species
+        name, or None if nothing is left to claim.
+        """
+        for todo in sorted(glob.glob(os.path.join(self.path, "todo", "*.json"))):
+            claimed = os.path.join(self.path, "claimed", os.path.basename(todo))
+            # Renaming keeps the queued file's mtime; touch it at once
+            # so expire() sees a fresh claim.
+            try:
+                os.rename(todo, claimed)
+                os.utime(claimed)
+            except FileNotFoundError:
+                continue
+
+            # Skip a species finished after its claim had expired.
+            name = os.path.basename(todo)
+            if any(os.path.exists(os.path.join(self.path, i, name)) for i in ("done", "failed")):
+                os.remove(claimed)
+                continue
+
+            # The file is ours now; record who holds it.
+            with open(claimed, 'r') as inf:
+                record = json.load(inf)
+            record.update({"worker": worker, "claimed": time.time()})
+            write_json(claimed, record)
+            return record["species"]
+        return None
+
+
+    def heartbeat(self, species):
+        """
+        Mark a claim as still alive.
+        """
+        try:
+            os.utime(self._file("claimed", species))
+        except FileNotFoundError:
+            pass
+
+
+    def finish(self, species, results, worker = None):
+        """
+        Record the (stage, status, info) results of a claimed species
+        in done/ or failed/, and release the claim if worker still
+        holds it.  A claim that expired and was taken by another worker
+        is left to that worker.
+        """
+        claimed = self._file("claimed", species)
+        try:
+            with open(claimed, 'r') as inf:
+                record = json.load(inf)
+        except FileNotFoundError:
+            record = {"species": species}
+        holder = record.get("worker")
+        ok = all(i[1] == "done" for i in results)
+        record.update({
+            "worker": worker if worker is not None else holder,
+            "finished": time.time(),
+            "stages": {stage: {"status": status, **info} for stage, status, info in results},
+        })
+        write_json(self._file("done" if ok else "failed", species), record, indent = 2)
+        if worker is not None and holder != worker:
+            logger.warning(f"{species} was claimed again by {holder}; leaving its claim")
+            return
+        try:
+            os.remove(claimed)
+        except FileNotFoundError:
+            pass
+
+
+    def expire(self):
+        """
+        Return claims whose heartbeat is older than ttl to todo/.
+        Returns the number of claims expired.
+        """
+        expired = 0
+        now = time.time()
+        for claimed in glob.glob(os.path.join(self.path, "claimed", "*.json")):
+            try:
+                if now - os.stat(claimed).st_mtime < self.ttl:
+                    continue
+                os.rename(claimed, os.path.join(self.path, "todo", os.path.basename(claimed)))
+            except FileNotFoundError:
+                continue
+            logger.warning(f"claim expired: {os.path.basename(claimed)}")
+            expired += 1
+        return expired
+
+
+    def counts(self):
+        """
+        Number of species in each state.
+        """
+        return {
+            state: len(glob.glob(os.path.join(self.path, state, "*.json")))
+            for state in STATES
+        }
+
+
+    def status(self):
+        """
+        Returns a dataframe with a row per finished or failed species:
+        worker, state, total seconds, and the seconds of each stage.
+        """
+        rows = []
+        for state in ("done", "failed"):
+            for path in glob.glob(os.path.join(self.path, state, "*.json")):
+                with open(path, 'r') as inf:
+                    record = json.load(inf)
+                row = {
+                    "species": record["species"],
+                    "state": state,
+                    "worker": record.get("worker"),
+                    "seconds": round(record["finished"] - record.get("claimed", record["finished"]), 2),
+                }
+                for stage, info in record["stages"].items():
+                    row[stage] = info.get("seconds")
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+
+def work(queue, workdir, stages, options, worker = None, runner = None):
+    """
+    Claim and run species from a WorkQueue until none are left to
+    claim.  A background thread keeps the current claim alive.
+    Returns the number of species run.
+
+    Parameters
+    ----------
+    queue: WorkQueue
+        The shared queue.
+    workdir: str
+        Shared output directory.
+    stages: tuple
+        Stages to run for each species, e.g. cli.REQUIRES["build"].
+    options: dict
+        Stage options, as passed to cli.run_species (see
+        cli.load_native).
+    worker: str
+        Worker name recorded with claims; defaults to host:pid.
+    runner: callable
+        Called as runner(species, stages, workdir, options) and
+        returning (stage, status, info) tuples; defaults to
+        cli.run_species.
+    """
+    if runner is None:
+        from sproc.cli import run_species as runner
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    current = {"species": None}
+    stop = threading.Event()
+
+    # Touch the current claim a few times per ttl.
+    def beat():
+        while not stop.wait(queue.ttl / 4.):
+            if current["species"]:
+                queue.heartbeat(current["species"])
+
+    thread = threading.Thread(target = beat, daemon = True)
+    thread.start()
+    count = 0
+    try:
+        while 1:
+            queue.expire()
+            species = queue.claim(worker)
+            if species is None:
+                break
+            current["species"] = species
+            logger.info(f"{worker} claimed {species}")
+            results = runner(species, stages, workdir, options)
+            queue.finish(species, results, worker)
+            current["species"] = None
+            count += 1
+    finally:
+        stop.set()
+        thread.join()
+    logger.info(f"{worker} ran {count} species")
+    return count
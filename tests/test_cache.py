@@ -0,0 +1,26 @@
+#!/usr/env/bin python
+
+"""
+The build cache in sproc.cache.
+"""
+
+import os
+import shapely
+from sproc.cache import BuildCache
+
+
+def test_unreadable_entry_is_miss(tmp_path):
+    cache = BuildCache(str(tmp_path))
+    box = shapely.box(0, 0, 1, 1)
+    cache.put("key", [0.5], [False], box, {0.01: box})
+    assert cache.get("key")["georange"].equals(box)
+
+    # An entry truncated or removed by another process is a miss.
+    entry = os.path.join(str(tmp_path), "key.npz")
+    with open(entry, 'rb') as inf:
+        content = inf.read()
+    with open(entry, 'wb') as outf:
+        outf.write(content[:len(content) // 2])
+    assert cache.get("key") is None
+    os.remove(entry)
+    assert cache.get("key") is None
@@ -0,0 +1,37 @@
+#!/usr/env/bin python
+
+"""
+Coordinate cleaning rules in sproc.clean.
+"""
+
+import pandas as pd
+from sproc.clean import CoordinateCleaner, DEFAULT_RULES, read_reference
+
+
+def test_swapped_coordinates():
+    data = pd.DataFrame({
+        "decimalLongitude": [38., 38., -4., -4.],
+        "decimalLatitude": [-4., -4., 38., 38.],
+        "countryCode": ["ES", "KE", "ES", None],
+    })
+    flags = CoordinateCleaner(rules = ["swapped"]).flags(data)
+
+    # Only the Spanish record entered as lat/lon lands in Spain when
+    # swapped; it falls in Kenya as given, and GBIF raised no issue.
+    assert flags.swapped.tolist() == [True, False, False, False]
+
+
+def test_default_reference_points():
+    assert "reference" in DEFAULT_RULES and "swapped" in DEFAULT_RULES
+    reference = read_reference()
+    centroid = reference[reference.name == "KE"].iloc[0]
+
+    # A record at a country centroid is flagged by the default rules.
+    data = pd.DataFrame({
+        "decimalLongitude": [centroid.decimalLongitude, centroid.decimalLongitude + 1.],
+        "decimalLatitude": [centroid.decimalLatitude, centroid.decimalLatitude],
+        "countryCode": ["KE", "KE"],
+    })
+    cleaner = CoordinateCleaner()
+    assert cleaner.apply(data).flagged.tolist() == [True, False]
+    assert cleaner.counts["reference"] == 1
@@ -0,0 +1,40 @@
+#!/usr/env/bin python
+
+"""
+Whole-taxon builds in sproc.genus.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from sproc.fetch import Fetch, FIELDS
+from sproc.genus import GenusRanges
+
+
+def fake_pages(self):
+    """
+    Pages of two species' records, with one record repeated across
+    pages and one record without a speciesKey.
+    """
+    rng = np.random.default_rng(0)
+    rows = [
+        (idx, float(skey), name, 40. + rng.uniform(-1, 1), -78. + rng.uniform(-1, 1), None, None, "US", None, "")
+        for idx, (skey, name) in enumerate([(1, "Quercus alba"), (2, "Quercus rubra")] * 6)
+    ]
+    rows.append((99, None, None, 40., -78., None, None, "US", None, ""))
+    yield pd.DataFrame(rows[:7], columns = FIELDS)
+    yield pd.DataFrame(rows[6:], columns = FIELDS)
+
+
+def test_pages_are_partitioned(tmp_path, monkeypatch):
+    monkeypatch.setattr(Fetch, "iter_pages", fake_pages)
+    checkpoint = tmp_path / "checkpoint"
+    checkpoint.mkdir()
+    genus = GenusRanges("Quercus", workdir = str(tmp_path / "ranges"), checkpoint = str(checkpoint))
+
+    # Each species has its records once, and every range was built.
+    assert sorted(genus.partitions) == ["Quercus alba", "Quercus rubra"]
+    assert [len(genus.partitions[i]) for i in sorted(genus.partitions)] == [6, 6]
+    assert len(genus.json_files) == 2
+    assert all(os.path.exists(i) for i in genus.json_files.values())
+    assert not checkpoint.exists()
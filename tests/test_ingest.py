@@ -0,0 +1,111 @@
+#!/usr/env/bin python
+
+"""
+Reading Darwin Core Archives with sproc.ingest.
+"""
+
+import os
+import zipfile
+import numpy as np
+import pytest
+from sproc.fetch import FIELDS
+from sproc.ingest import load_occurrences, ingest_ranges
+
+
+# Core columns of the archive, in file order.  'occurrenceID' is not a
+# FIELDS column and must be skipped.
+TERMS = (
+    ("gbifID", "http://rs.gbif.org/terms/1.0/gbifID"),
+    ("occurrenceID", "http://rs.tdwg.org/dwc/terms/occurrenceID"),
+    ("species", "http://rs.tdwg.org/dwc/terms/species"),
+    ("decimalLatitude", "http://rs.tdwg.org/dwc/terms/decimalLatitude"),
+    ("decimalLongitude", "http://rs.tdwg.org/dwc/terms/decimalLongitude"),
+    ("year", "http://rs.tdwg.org/dwc/terms/year"),
+    ("issue", "http://rs.gbif.org/terms/1.0/issue"),
+)
+
+ROWS = (
+    ("101", "a\"1", "Quercus alba", "40.5", "-75.25", "1990", "ZERO_COORDINATE"),
+    ("102", "a2", "Quercus alba", "41.0", "-76.0", "", ""),
+    ("103", "r1", "Quercus rubra", "45.125", "-80.5", "2001", ""),
+    ("104", "r2", "Quercus rubra", "", "", "2002", ""),
+    ("101", "a\"1", "Quercus alba", "40.5", "-75.25", "1990", "ZERO_COORDINATE"),
+)
+
+
+def write_archive(path, header):
+    """
+    Write a Darwin Core Archive with a tab separated core table, with
+    a header line and ignoreHeaderLines=1, or without either.
+    """
+    fields = "\n".join(
+        f'    <field index="{idx}" term="{term}"/>'
+        for idx, (_, term) in enumerate(TERMS)
+    )
+    meta = (
+        '<archive xmlns="http://rs.tdwg.org/dwc/text/">\n'
+        f'  <core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" '
+        f'ignoreHeaderLines="{int(header)}" rowType="http://rs.tdwg.org/dwc/terms/Occurrence">\n'
+        '    <files><location>occurrence.txt</location></files>\n'
+        '    <id index="0"/>\n'
+        f'{fields}\n'
+        '  </core>\n'
+        '</archive>\n'
+    )
+    lines = ["\t".join(i) for i in ROWS]
+    if header:
+        lines.insert(0, "\t".join(name for name, _ in TERMS))
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("meta.xml", meta)
+        archive.writestr("occurrence.txt", "\n".join(lines) + "\n")
+    return str(path)
+
+
+@pytest.mark.parametrize("header", [False, True])
+def test_columns_and_dtypes(tmp_path, header):
+    data = load_occurrences(write_archive(tmp_path / "dwca.zip", header), chunksize = 2)
+
+    # Renamed and missing columns follow FIELDS.
+    assert list(data.columns) == FIELDS
+    assert "gbifID" not in data.columns and "issue" not in data.columns
+    assert str(data.key.dtype) == "int64"
+    assert str(data.decimalLatitude.dtype) == "float64"
+    assert str(data.decimalLongitude.dtype) == "float64"
+    assert str(data.year.dtype) == "float64"
+    assert str(data.species.dtype) == "category"
+
+    # Records without coordinates and duplicate keys are dropped.
+    assert data.key.tolist() == [101, 102, 103]
+    assert data.decimalLongitude.tolist() == [-75.25, -76.0, -80.5]
+    assert data.issues.tolist()[0] == "ZERO_COORDINATE"
+    assert data.year.isna().tolist() == [False, True, False]
+    assert data.speciesKey.isna().all()
+
+
+@pytest.mark.parametrize("header", [False, True])
+def test_species_filter(tmp_path, header):
+    path = write_archive(tmp_path / "dwca.zip", header)
+    data = load_occurrences(path, species = ["Quercus rubra"])
+    assert data.key.tolist() == [103]
+    assert set(data.species) == {"Quercus rubra"}
+    assert load_occurrences(path, species = ["Quercus robur"]).empty
+
+
+def test_ingest_ranges_without_species_keys(tmp_path):
+    rng = np.random.default_rng(0)
+    rows = ["species,decimalLatitude,decimalLongitude"]
+    for name, (lat, lon) in (("Quercus alba", (40., -78.)), ("Quercus rubra", (45., -90.))):
+        rows += [f"{name},{y:.4f},{x:.4f}" for y, x in zip(lat + rng.uniform(-1, 1, 12), lon + rng.uniform(-1, 1, 12))]
+    path = tmp_path / "records.csv"
+    path.write_text("\n".join(rows) + "\n")
+
+    # Missing columns get their FIELDS dtypes, and rows are keyed in order.
+    data = load_occurrences(str(path))
+    assert str(data.eventDate.dtype) == "object"
+    assert str(data.issues.dtype) == "object"
+    assert data.key.tolist() == list(range(24))
+
+    # Records are split by name when the file has no speciesKey.
+    json_files = ingest_ranges(str(path), workdir = str(tmp_path / "ranges"))
+    assert sorted(json_files) == ["Quercus alba", "Quercus rubra"]
+    assert all(os.path.exists(i) for i in json_files.values())
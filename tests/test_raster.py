@@ -0,0 +1,52 @@
+#!/usr/env/bin python
+
+"""
+Screening range pairs with sproc.raster.
+"""
+
+import json
+import shapely
+import shapely.geometry
+from sproc.overlap import overlap_matrix
+from sproc.raster import RangeGrid
+
+
+def write_range(path, geom):
+    """
+    Write a minimal sproc GeoJSON file holding one geographic_range.
+    """
+    with open(path, 'w') as outf:
+        json.dump({
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "properties": {"type": "geographic_range"},
+                "geometry": shapely.geometry.mapping(geom),
+            }],
+        }, outf)
+    return str(path)
+
+
+def test_screen_keeps_corner_overlap(tmp_path):
+    # The long edge of a clips only the corner of the cell holding b,
+    # between two of its sample points.
+    a = shapely.Polygon([(-10, -10), (10.05, -10), (-3, 3.05)])
+    b = shapely.Polygon([(0.005, 0.005), (0.02, 0.005), (0.005, 0.02)])
+    files = [write_range(tmp_path / "a.json", a), write_range(tmp_path / "b.json", b)]
+
+    grid = RangeGrid(files, resolution = 1)
+    assert grid.counts[0, 1] == 1
+    assert grid.candidates() == [(0, 1)]
+    matrix = overlap_matrix(files, pairs = grid.candidates())
+    assert matrix.iloc[1, 0] == 1.
+
+
+def test_touched_cells(tmp_path):
+    # Every cell touched by the range, and no other, is set.
+    geom = shapely.Polygon([(0.3, 0.2), (7.9, 1.1), (4.2, 6.7), (0.1, 3.3)])
+    grid = RangeGrid([write_range(tmp_path / "a.json", geom)], resolution = 1)
+    cells = grid.burn(geom).reshape(grid.nrows, grid.ncols)
+    for row in range(88, 100):
+        for col in range(178, 192):
+            box = shapely.box(col - 180, row - 90, col - 179, row - 89)
+            assert cells[row, col] == shapely.intersects(geom, box)
@@ -0,0 +1,34 @@
+#!/usr/env/bin python
+
+"""
+Spatial thinning with sproc.thin.
+"""
+
+import pandas as pd
+from sproc.thin import thin
+
+
+DATA = pd.DataFrame({
+    "key": [1, 2, 3, 4, 5],
+    "decimalLongitude": [10.01, 10.02, 10.03, 10.04, 20.05],
+    "decimalLatitude": [5.01, 5.02, 5.03, 5.04, 5.05],
+    "flagged": [False, True, False, True, False],
+    "introduced": [False, False, False, False, False],
+})
+
+
+def test_one_record_per_cell():
+    thinned = thin(DATA, resolution = 1.)
+    assert len(thinned) == 2
+    assert thinned["count"].tolist() == [4, 1]
+
+
+def test_groups_are_thinned_apart():
+    thinned = thin(DATA, resolution = 1., by = ["flagged", "introduced"])
+
+    # Flagged records are never represented by a kept one, or the reverse.
+    assert len(thinned) == 3
+    counts = thinned.groupby("flagged")["count"].sum()
+    assert counts[True] == 2 and counts[False] == 3
+    for _, row in thinned.iterrows():
+        assert row.flagged == DATA.set_index("key").loc[row.key, "flagged"]
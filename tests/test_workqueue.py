@@ -0,0 +1,99 @@
+#!/usr/env/bin python
+
+"""
+The shared-directory work queue in sproc.workqueue.
+"""
+
+import os
+import time
+import json
+import multiprocessing
+import sproc.workqueue
+from sproc.workqueue import WorkQueue, work
+
+
+SPECIES = [f"Quercus species{idx}" for idx in range(12)]
+
+
+def stub_runner(species, stages, workdir, options):
+    """
+    Stage runner that leaves one marker file per run of a species.
+    """
+    with open(os.path.join(workdir, f"{species}.{os.getpid()}.run"), 'w'):
+        pass
+    time.sleep(0.02)
+    return [(stage, "done", {"seconds": 0.02}) for stage in stages]
+
+
+def run_worker(path, workdir, name):
+    work(WorkQueue(path), workdir, ("fetch", "build"), {}, worker = name, runner = stub_runner)
+
+
+def test_processes_share_queue(tmp_path):
+    path = str(tmp_path / "queue")
+    queue = WorkQueue(path)
+    assert queue.fill(SPECIES) == len(SPECIES)
+    assert queue.fill(SPECIES) == 0
+
+    # A claim left by a worker that died an hour ago.
+    assert queue.claim("dead") == SPECIES[0]
+    stale = time.time() - 3600
+    os.utime(queue._file("claimed", SPECIES[0]), (stale, stale))
+
+    # Run workers in separate processes.
+    procs = [
+        multiprocessing.Process(target = run_worker, args = (path, str(tmp_path), f"w{idx}"))
+        for idx in range(4)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(60)
+        assert proc.exitcode == 0
+
+    # Every species ran exactly once, including the expired claim.
+    assert queue.counts() == {"todo": 0, "claimed": 0, "done": len(SPECIES), "failed": 0}
+    runs = [i.split(".")[0] for i in os.listdir(tmp_path) if i.endswith(".run")]
+    assert sorted(runs) == sorted(SPECIES)
+    status = queue.status()
+    assert set(status.worker) <= {"w0", "w1", "w2", "w3"}
+    assert (status.state == "done").all()
+
+
+def test_finish_keeps_reclaimed_claim(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue"), ttl = 0.)
+    queue.fill(SPECIES[:1])
+    assert queue.claim("w1") == SPECIES[0]
+
+    # The claim expires and another worker takes it.
+    assert queue.expire() == 1
+    assert queue.claim("w2") == SPECIES[0]
+
+    # The first worker finishing must not release the second's claim.
+    queue.finish(SPECIES[0], [("build", "done", {})], "w1")
+    claimed = queue._file("claimed", SPECIES[0])
+    with open(claimed, 'r') as inf:
+        assert json.load(inf)["worker"] == "w2"
+    with open(queue._file("done", SPECIES[0]), 'r') as inf:
+        assert json.load(inf)["worker"] == "w1"
+
+    queue.finish(SPECIES[0], [("build", "done", {})], "w2")
+    assert not os.path.exists(claimed)
+
+
+def test_claim_is_fresh(tmp_path, monkeypatch):
+    queue = WorkQueue(str(tmp_path / "queue"), ttl = 60.)
+    queue.fill(SPECIES[:1])
+    stale = time.time() - 3600
+    os.utime(queue._file("todo", SPECIES[0]), (stale, stale))
+
+    # Another worker expires claims while this one is still claiming.
+    write_json = sproc.workqueue.write_json
+    def expire_then_write(path, obj, **kwargs):
+        assert WorkQueue(queue.path, ttl = 60.).expire() == 0
+        write_json(path, obj, **kwargs)
+    monkeypatch.setattr(sproc.workqueue, "write_json", expire_then_write)
+
+    # A species queued long ago is not expired as soon as it is claimed.
+    assert queue.claim("w1") == SPECIES[0]
+    assert queue.counts()["todo"] == 0